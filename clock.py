@@ -0,0 +1,87 @@
+"""Clocks pacing the playback of songs.
+
+Copyright 2015 Google Inc. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import ctypes
+import ctypes.util
+import sys
+import time
+
+# Clock id of clock_gettime() on Linux.
+_CLOCK_MONOTONIC = 1
+
+
+class _Timespec(ctypes.Structure):
+  _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+
+def _MonotonicTimeFunction():
+  """Returns a function returning monotonic time in seconds, or None if the
+  system does not provide one."""
+  if hasattr(time, 'monotonic'):
+    return time.monotonic
+  if not sys.platform.startswith('linux'):
+    return None
+  try:
+    librt = ctypes.CDLL(ctypes.util.find_library('rt') or 'librt.so.1',
+                        use_errno=True)
+    clock_gettime = librt.clock_gettime
+  except (OSError, AttributeError):
+    return None
+  clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(_Timespec)]
+  timespec = _Timespec()
+
+  def Monotonic():
+    if clock_gettime(_CLOCK_MONOTONIC, ctypes.byref(timespec)) != 0:
+      raise OSError(ctypes.get_errno(), 'clock_gettime failed')
+    return timespec.tv_sec + timespec.tv_nsec * 1e-9
+  return Monotonic
+
+
+class MonotonicClock(object):
+  """Wall clock which is never set back, unlike time.time().
+
+  Uses clock_gettime(CLOCK_MONOTONIC) when available. Otherwise falls back to
+  time.time(), and only guarantees that the time returned never decreases.
+  """
+
+  def __init__(self):
+    self._monotonic = _MonotonicTimeFunction()
+    self._last = 0.0
+
+  def Now(self):
+    """Returns the current time in seconds, from an arbitrary origin."""
+    if self._monotonic:
+      return self._monotonic()
+    self._last = max(self._last, time.time())
+    return self._last
+
+  def Sleep(self, seconds):
+    time.sleep(seconds)
+
+
+class SimulatedClock(object):
+  """Clock whose time only passes when sleeping, so that playback paced by it
+  runs as fast as possible, e.g. in benchmarks and tests."""
+
+  def __init__(self, start=0.0):
+    self._now = start
+
+  def Now(self):
+    return self._now
+
+  def Sleep(self, seconds):
+    self._now += max(0.0, seconds)
@@ -0,0 +1,210 @@
+"""Per-phase timing of the frames of the waterfall.
+
+Copyright 2015 Google Inc. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import csv
+import sys
+import timeit
+
+# Phases of a frame, in the order Waterfall.Continue runs them. Each phase
+# lasts from the previous Mark (or BeginFrame) to its own Mark.
+INPUT = 0  # Applying the piano input.
+SCORE = 1  # Integrating the score.
+DECODE = 2  # Decoding the events of lazily loaded songs.
+PIANO = 3  # Drawing the keyboard and the key highlights.
+NOTES = 4  # Laying out or scrolling the note bars.
+TITLE = 5  # Updating the score and the overlay texts.
+REFRESH = 6  # Tk's canvas.update(), which renders the frame.
+SLEEP = 7  # Waiting for the next frame.
+ADVANCE = 8  # Moving the song forward.
+PHASE_NAMES = ('input', 'score', 'decode', 'piano', 'notes', 'title',
+               'refresh', 'sleep', 'advance')
+
+
+def _Percentile(ordered, fraction):
+  return ordered[int(fraction * (len(ordered) - 1))]
+
+
+class NullFrameProfiler(object):
+  """Profiler which records nothing, used when profiling is disabled. Its
+  methods do nothing, so an unprofiled frame only pays for the calls."""
+
+  show_overlay = False
+
+  def BeginFrame(self):
+    pass
+
+  def Mark(self, phase):
+    pass
+
+  def EndFrame(self, canvas, overrun, dropped_frames):
+    pass
+
+  def Report(self, title):
+    pass
+
+
+NULL_PROFILER = NullFrameProfiler()
+
+
+class FrameProfiler(object):
+  """Records the time spent in each phase of the last frames.
+
+  Frames are kept in a ring buffer of |capacity| rows, so profiling long
+  songs uses constant memory and only the most recent frames are reported.
+  Times are measured with timeit.default_timer, which is independent of the
+  (possibly simulated) clock pacing the waterfall.
+
+  Attributes:
+    capacity: Number of frames kept.
+    num_frames: Number of frames recorded since the last Reset().
+    show_overlay: Whether the waterfall shows OverlayText() on screen.
+    csv_path: If set, Report() writes the frames kept to this CSV file,
+        replacing it.
+    out: File Report() prints the summary to.
+  """
+
+  OVERLAY_FRAMES = 30  # The overlay shows averages over this many frames.
+
+  def __init__(self, capacity=3600, show_overlay=False, csv_path=None,
+               out=sys.stdout):
+    self.capacity = capacity
+    self.show_overlay = show_overlay
+    self.csv_path = csv_path
+    self.out = out
+    self.Reset()
+
+  def Reset(self):
+    """Forgets all recorded frames."""
+    self.num_frames = 0
+    # Rows of (start time, phase times, total time, overrun, dropped frames,
+    # number of canvas items), all times in seconds.
+    self._rows = [None] * self.capacity
+    self._times = [0.0] * len(PHASE_NAMES)
+    self._frame_start = self._last_mark = timeit.default_timer()
+    self._overlay_text = ''
+
+  def BeginFrame(self):
+    self._times = [0.0] * len(PHASE_NAMES)
+    self._frame_start = self._last_mark = timeit.default_timer()
+
+  def Mark(self, phase):
+    """Ends |phase|, which is charged the time since the previous mark."""
+    now = timeit.default_timer()
+    self._times[phase] += now - self._last_mark
+    self._last_mark = now
+
+  def EndFrame(self, canvas, overrun, dropped_frames):
+    """Stores the frame begun by BeginFrame.
+
+    Args:
+      canvas: Canvas the frame was drawn on, whose items are counted.
+      overrun: Seconds by which the frame missed its deadline, or 0.
+      dropped_frames: Number of frames dropped after this one.
+    """
+    self._rows[self.num_frames % self.capacity] = (
+        self._frame_start, self._times, self._last_mark - self._frame_start,
+        overrun, dropped_frames, len(canvas.find_all()))
+    self.num_frames += 1
+
+  def Rows(self):
+    """Returns the rows of the frames kept, oldest first."""
+    if self.num_frames <= self.capacity:
+      return self._rows[:self.num_frames]
+    start = self.num_frames % self.capacity
+    return self._rows[start:] + self._rows[:start]
+
+  def _LastRows(self, count):
+    count = min(count, self.num_frames, self.capacity)
+    end = self.num_frames % self.capacity
+    if count <= end:
+      return self._rows[end - count:end]
+    return self._rows[end - count:] + self._rows[:end]
+
+  def OverlayText(self):
+    """Returns a line of the mean phase times (in ms) of the last frames.
+    It is only recomputed every OVERLAY_FRAMES frames."""
+    if self.num_frames % self.OVERLAY_FRAMES == 0 or not self._overlay_text:
+      rows = self._LastRows(self.OVERLAY_FRAMES)
+      if rows:
+        means = [sum(row[1][phase] for row in rows) * 1000 / len(rows)
+                 for phase in xrange(len(PHASE_NAMES))]
+        busy = sum(means) - means[SLEEP]
+        self._overlay_text = ' '.join(
+            ['busy %.1f ms:' % busy] +
+            ['%s %.1f' % (name, mean)
+             for name, mean in zip(PHASE_NAMES, means)
+             if mean >= 0.05 and name != 'sleep'])
+    return self._overlay_text
+
+  def Summary(self):
+    """Returns a dict of the mean, p95 and max (in seconds) of each phase
+    and of the busy time of the frames kept (their total time minus the
+    sleep), and of their overrun, dropped frames and canvas items."""
+    rows = self.Rows()
+    if not rows:
+      return {}
+    columns = [(name, [row[1][phase] for row in rows])
+               for phase, name in enumerate(PHASE_NAMES)]
+    columns += [('busy', [row[2] - row[1][SLEEP] for row in rows]),
+                ('overrun', [row[3] for row in rows]),
+                ('dropped', [row[4] for row in rows]),
+                ('items', [row[5] for row in rows])]
+    summary = {}
+    for name, values in columns:
+      ordered = sorted(values)
+      summary[name] = {'mean': float(sum(ordered)) / len(ordered),
+                       'p95': _Percentile(ordered, 0.95),
+                       'max': ordered[-1]}
+    return summary
+
+  def Report(self, title):
+    """Prints a summary of the frames kept, writes them to |csv_path| if
+    set, and starts recording anew."""
+    rows = self.Rows()
+    print >>self.out, 'Frame profile of %s: %d frames%s' % (
+        title, self.num_frames,
+        ', last %d kept' % len(rows) if len(rows) < self.num_frames else '')
+    if rows:
+      summary = self.Summary()
+      for name in PHASE_NAMES + ('busy', 'overrun'):
+        print >>self.out, (
+            '  %-8s mean %6.2f ms, p95 %6.2f ms, max %6.2f ms' % (
+                name, summary[name]['mean'] * 1000,
+                summary[name]['p95'] * 1000, summary[name]['max'] * 1000))
+      print >>self.out, '  dropped  %d frames; items mean %.0f, max %d' % (
+          sum(row[4] for row in rows), summary['items']['mean'],
+          summary['items']['max'])
+      if self.csv_path:
+        self.WriteCsv(self.csv_path)
+    self.Reset()
+
+  def WriteCsv(self, path):
+    """Writes the frames kept to |path|, one row per frame, times in ms.
+    Frame start times are relative to the first frame kept."""
+    rows = self.Rows()
+    with open(path, 'wb') as f:
+      writer = csv.writer(f)
+      writer.writerow(('frame', 'start') + PHASE_NAMES +
+                      ('total', 'overrun', 'dropped', 'items'))
+      first = self.num_frames - len(rows)
+      for i, row in enumerate(rows):
+        start, times, total, overrun, dropped, items = row
+        writer.writerow(
+            [first + i, '%.3f' % ((start - rows[0][0]) * 1000)] +
+            ['%.3f' % (t * 1000) for t in times] +
+            ['%.3f' % (total * 1000), '%.3f' % (overrun * 1000), dropped,
+             items])
@@ -0,0 +1,93 @@
+"""Queue of piano input which can be waited on without polling.
+
+Copyright 2015 Google Inc. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import errno
+import fcntl
+import os
+import Queue
+import select
+
+
+def _SetNonBlocking(fd):
+  fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+
+class InputQueue(Queue.Queue):
+  """Queue.Queue which also writes a byte to a wakeup pipe for every item put.
+
+  The read end of the pipe (fileno()) becomes readable when input arrives, so
+  consumers can sleep in select() or in Tk's event loop (with a file handler)
+  until then, instead of polling empty(). To wait without missing input,
+  call ClearWakeup() first, then check empty(), and only then wait for the
+  pipe: input put after the check always leaves a byte in the pipe.
+  """
+
+  def __init__(self, maxsize=0):
+    Queue.Queue.__init__(self, maxsize)
+    self._wakeup_read, self._wakeup_write = os.pipe()
+    _SetNonBlocking(self._wakeup_read)
+    _SetNonBlocking(self._wakeup_write)
+
+  def _put(self, item):
+    Queue.Queue._put(self, item)
+    self._Wake()
+
+  def _Wake(self):
+    try:
+      os.write(self._wakeup_write, 'x')
+    except OSError as e:
+      # A full pipe is readable already.
+      if e.errno != errno.EAGAIN:
+        raise
+
+  def PutMany(self, items):
+    """Puts all |items| at once, so that a consumer emptying the queue gets
+    either none or all of them. Never blocks, even if the queue has a
+    maxsize."""
+    if not items:
+      return
+    with self.mutex:
+      self.queue.extend(items)
+      self.unfinished_tasks += len(items)
+      self.not_empty.notify()
+      self._Wake()
+
+  def fileno(self):
+    """Returns the file descriptor which is readable when input arrived."""
+    return self._wakeup_read
+
+  def ClearWakeup(self):
+    """Empties the wakeup pipe."""
+    try:
+      while os.read(self._wakeup_read, 4096):
+        pass
+    except OSError as e:
+      if e.errno != errno.EAGAIN:
+        raise
+
+  def Wait(self, timeout=None):
+    """Blocks until the queue is not empty, or for at most |timeout| seconds
+    if set. Returns whether the queue is not empty."""
+    self.ClearWakeup()
+    if not self.empty():
+      return True
+    try:
+      select.select([self._wakeup_read], [], [], timeout)
+    except select.error as e:
+      if e.args[0] != errno.EINTR:
+        raise
+    return not self.empty()
@@ -0,0 +1,269 @@
+"""Recording and replay of the piano input of playing sessions.
+
+Usage:
+  python input_recorder.py info <recording>
+      Prints the segments of a recording.
+  python input_recorder.py replay <recording> [--song FILE] [--realtime]
+                                  [--fps N]
+      Plays the song again on a headless display, with the recorded input,
+      and compares the scores to the recorded ones. By default, time is
+      simulated, so the replay runs as fast as possible.
+
+A recording holds a playthrough of a song, from its start, with one segment
+per Waterfall.Continue call: the wall time and song position it started at,
+its slowdown factor, the timestamped input it processed, and its final score.
+Input times are stored as 64-bit counts of microseconds from the start of
+their segment.
+
+Copyright 2015 Google Inc. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import argparse
+import collections
+import json
+import struct
+import timeit
+
+import clock
+import midi
+import piano_output_headless
+import waterfall
+
+MAGIC = 'LMPI'
+VERSION = 2
+_HEADER = struct.Struct('<4sBH')  # Magic, version, metadata size.
+
+# Records, each starting with its kind.
+_SEGMENT = struct.Struct('<cddd')  # 's', wall time, tick, slowdown factor.
+_INPUT = struct.Struct('<cqBB')  # 'i', microseconds, note, volume.
+_END = struct.Struct('<cqd')  # 'e', microseconds, score.
+
+# One Waterfall.Continue call of a recording:
+#   start: Wall clock time at which the segment started.
+#   tick: Song position at which the segment started.
+#   slowdown_factor: Slowdown the song was played with.
+#   events: List of (timestamp, note, volume) of the input processed.
+#   end, score: Wall clock time and score at the end of the segment, or None
+#       if the recording was cut short.
+Segment = collections.namedtuple(
+    'Segment', ['start', 'tick', 'slowdown_factor', 'events', 'end', 'score'])
+
+
+class InputRecorder(object):
+  """Writes the input processed by a waterfall to a file, as it plays.
+  Set as the input_recorder of a waterfall.Waterfall.
+
+  Attributes:
+    fname: Name of the file written.
+  """
+
+  def __init__(self, fname, song='', hand='both'):
+    """|song| and |hand| are stored for replaying."""
+    self.fname = fname
+    self._file = open(fname, 'wb')
+    metadata = json.dumps({'song': song, 'hand': hand})
+    self._file.write(_HEADER.pack(MAGIC, VERSION, len(metadata)) + metadata)
+    self._start = 0.0
+
+  def _Microseconds(self, time):
+    return int(round((time - self._start) * 1e6))
+
+  def Start(self, time, tick, slowdown_factor):
+    """Starts a segment at wall clock |time| and song position |tick|."""
+    self._start = time
+    self._file.write(_SEGMENT.pack('s', time, tick, slowdown_factor))
+
+  def Record(self, timestamp, note, volume):
+    self._file.write(_INPUT.pack('i', self._Microseconds(timestamp), note,
+                                 min(volume, 255)))
+
+  def End(self, time, score):
+    """Ends the segment at wall clock |time|, with the final |score|."""
+    self._file.write(_END.pack('e', self._Microseconds(time), score))
+    self._file.flush()
+
+  def Close(self):
+    self._file.close()
+
+
+class Recording(object):
+  """Recording read from a file written by InputRecorder.
+
+  Attributes:
+    song: Name of the midi file played.
+    hand: Hand the song was played with.
+    segments: List of Segment.
+  """
+
+  def __init__(self, fname):
+    with open(fname, 'rb') as f:
+      data = f.read()
+    magic, version, metadata_size = _HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+      raise ValueError('%s is not a version %d input recording' % (
+          fname, VERSION))
+    offset = _HEADER.size + metadata_size
+    metadata = json.loads(data[_HEADER.size:offset])
+    self.song = metadata['song']
+    self.hand = metadata['hand']
+    self.segments = []
+    segment = None
+    while offset < len(data):
+      kind = data[offset]
+      if kind == 's':
+        _, start, tick, slowdown_factor = _SEGMENT.unpack_from(data, offset)
+        offset += _SEGMENT.size
+        segment = Segment(start, tick, slowdown_factor, [], None, None)
+        self.segments.append(segment)
+      elif kind == 'i' and segment:
+        _, microseconds, note, volume = _INPUT.unpack_from(data, offset)
+        offset += _INPUT.size
+        segment.events.append((segment.start + microseconds * 1e-6, note,
+                               volume))
+      elif kind == 'e' and segment:
+        _, microseconds, score = _END.unpack_from(data, offset)
+        offset += _END.size
+        segment = segment._replace(end=segment.start + microseconds * 1e-6,
+                                   score=score)
+        self.segments[-1] = segment
+      else:
+        raise ValueError('%s: bad record at offset %d' % (fname, offset))
+
+
+class _ReplayQueue(object):
+  """Queue holding the recorded events whose time has come."""
+
+  def __init__(self, events, clock_obj, offset):
+    self._events = events
+    self._clock = clock_obj
+    self._offset = offset
+    self._next = 0
+
+  def empty(self):
+    return (self._next >= len(self._events) or
+            self._events[self._next][0] + self._offset > self._clock.Now())
+
+  def get(self):
+    timestamp, note, volume = self._events[self._next]
+    self._next += 1
+    return (note, volume, timestamp + self._offset)
+
+
+class ReplayInput(object):
+  """Piano input replaying the events of a recorded segment, each when
+  |clock| reaches its timestamp plus |offset|.
+
+  Attributes:
+    user_input: Queue-like object with the events due, as (note, volume,
+        timestamp) tuples.
+    clock: Clock of the waterfall replaying the segment.
+  """
+
+  def __init__(self, events, clock_obj, offset=0.0):
+    self.clock = clock_obj
+    self.user_input = _ReplayQueue(events, clock_obj, offset)
+
+  def ClearInput(self):
+    pass
+
+
+def ReplaySegment(waterfall_obj, segment, realtime=False):
+  """Plays |segment| on |waterfall_obj| with its recorded input. Time is
+  simulated unless |realtime| is set. Returns the score.
+
+  The segments of a recording are replayed in order on the same waterfall:
+  a segment starting at tick 0 restarts the song, and the others resume it.
+  If the song is behind the segment, as when the menu gesture was replayed
+  slightly earlier than recorded in real time, it is moved forward, and the
+  notes it passes are expected by the score keeper from the segment start.
+  """
+  if realtime:
+    clock_obj = clock.MonotonicClock()
+    offset = clock_obj.Now() - segment.start
+  else:
+    # Starts at the recorded time, so that no timestamp is shifted.
+    clock_obj = clock.SimulatedClock(segment.start)
+    offset = 0.0
+  if segment.tick == 0 and waterfall_obj.cursor.time > 0:
+    waterfall_obj.Restart()
+  if segment.tick > waterfall_obj.cursor.time:
+    for _, note, playing in waterfall_obj.Advance(
+        segment.tick - waterfall_obj.cursor.time):
+      waterfall_obj.score_keeper.Expect(clock_obj.Now(), note, playing)
+  waterfall_obj.clock = clock_obj
+  # Replayed timestamps are on |clock_obj|, so latencies must be too.
+  input_latency = waterfall_obj.piano_output.input_latency
+  input_latency.clock = clock_obj
+  waterfall_obj.piano_input = ReplayInput(segment.events, clock_obj, offset)
+  score = waterfall_obj.Continue(segment.slowdown_factor)
+  # The menu would show the input left undisplayed, such as its gesture.
+  input_latency.Displayed()
+  return score
+
+
+def Info(args):
+  recording = Recording(args.recording)
+  print 'Song: %s (%s hand%s)' % (recording.song, recording.hand,
+                                  's' if recording.hand == 'both' else '')
+  for i, segment in enumerate(recording.segments):
+    print ('Segment %d: from tick %d, slowdown %.1f, %d input events, '
+           '%s' % (i, segment.tick, segment.slowdown_factor,
+                   len(segment.events),
+                   'cut short' if segment.end is None else
+                   '%.1f s, score %d' % (segment.end - segment.start,
+                                         segment.score)))
+
+
+def Replay(args):
+  recording = Recording(args.recording)
+  midi_file = midi.MidiFile(args.song or recording.song)
+  waterfall_obj = waterfall.Waterfall(
+      None, piano_output_headless.HeadlessPianoOutput(), midi_file,
+      hand=recording.hand, frames_per_sec=args.fps, name=recording.song)
+  for i, segment in enumerate(recording.segments):
+    start = timeit.default_timer()
+    score = ReplaySegment(waterfall_obj, segment, realtime=args.realtime)
+    elapsed = timeit.default_timer() - start
+    print 'Segment %d: replayed in %.2f s, score %d (recorded %s)' % (
+        i, elapsed, score,
+        'none' if segment.score is None else '%d' % segment.score)
+
+
+def main():
+  parser = argparse.ArgumentParser(
+      description=__doc__.split('\n\n')[0],
+      formatter_class=argparse.RawDescriptionHelpFormatter,
+      epilog='\n\n'.join(__doc__.split('\n\n')[1:3]))
+  commands = parser.add_subparsers()
+
+  info = commands.add_parser('info')
+  info.add_argument('recording')
+  info.set_defaults(function=Info)
+
+  replay = commands.add_parser('replay')
+  replay.add_argument('recording')
+  replay.add_argument('--song', help='midi file to play, if it moved since '
+                      'the recording')
+  replay.add_argument('--realtime', action='store_true',
+                      help='replay in real time instead of simulated time')
+  replay.add_argument('--fps', type=int, default=60)
+  replay.set_defaults(function=Replay)
+
+  args = parser.parse_args()
+  args.function(args)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,220 @@
+"""Screen positions of the piano keys, with projector calibration profiles.
+
+Usage:
+  python key_geometry.py <number of keys> <profile.json>
+      Writes the default profile of a 61, 76 or 88 key keyboard, to be edited
+      with the measured offsets of the keys and the keystone of the projector.
+
+Copyright 2015 Google Inc. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import json
+import sys
+
+OCTAVE_WIDTH = 158.0
+WHITE_NOTE_WIDTH = OCTAVE_WIDTH / 7.0
+BLACK_NOTE_WIDTH = WHITE_NOTE_WIDTH / 2.0
+BLACK_NOTE_WIDE_WIDTH = WHITE_NOTE_WIDTH / 1.0
+NOTE_IND_TO_PARAMS = {0: (0.0, WHITE_NOTE_WIDTH),
+                      1: (12.2, BLACK_NOTE_WIDTH),
+                      2: (21.8, WHITE_NOTE_WIDTH),
+                      3: (40.5, BLACK_NOTE_WIDTH),
+                      4: (44.3, WHITE_NOTE_WIDTH),
+                      5: (66.9, WHITE_NOTE_WIDTH),
+                      6: (80.2, BLACK_NOTE_WIDTH),
+                      7: (90.2, WHITE_NOTE_WIDTH),
+                      8: (106.5, BLACK_NOTE_WIDTH),
+                      9: (112.4, WHITE_NOTE_WIDTH),
+                      10: (132.9, BLACK_NOTE_WIDTH),
+                      11: (135.5, WHITE_NOTE_WIDTH)}
+NOTE_IND_TO_PARAMS_WIDE = {0: (0.0, WHITE_NOTE_WIDTH),
+                           1: (12.2-4, BLACK_NOTE_WIDE_WIDTH),
+                           2: (21.8, WHITE_NOTE_WIDTH),
+                           3: (40.5-4, BLACK_NOTE_WIDE_WIDTH),
+                           4: (44.3, WHITE_NOTE_WIDTH),
+                           5: (66.9, WHITE_NOTE_WIDTH),
+                           6: (80.2-4, BLACK_NOTE_WIDE_WIDTH),
+                           7: (90.2, WHITE_NOTE_WIDTH),
+                           8: (106.5-4, BLACK_NOTE_WIDE_WIDTH),
+                           9: (112.4, WHITE_NOTE_WIDTH),
+                           10: (132.9-4, BLACK_NOTE_WIDE_WIDTH),
+                           11: (135.5, WHITE_NOTE_WIDTH)}
+WHITE_NOTES = (0,2,4,5,7,9,11)
+
+# Height (in pixels) of the part of the white keys below the black keys.
+BLACK_KEY_GAP = 50
+
+NUM_NOTES = 128  # Tables cover all midi notes, even those off the keyboard.
+
+# Lowest and highest notes of the usual keyboard sizes.
+KEY_RANGES = {61: (36, 96), 76: (28, 103), 88: (21, 108)}
+
+
+def noteToPhysicalInterval(note, wide):
+  if wide:
+    interval = NOTE_IND_TO_PARAMS_WIDE[int(note) % 12]
+  else:
+    interval = NOTE_IND_TO_PARAMS[int(note) % 12]
+  start = (int(note) / 12) * OCTAVE_WIDTH + interval[0]
+  return (start, start + interval[1])
+
+
+class CalibrationProfile(object):
+  """Describes a keyboard, and how the projector image falls on it.
+
+  Attributes:
+    name: Description of the keyboard.
+    lowest_note, highest_note: Range of the keys of the keyboard.
+    key_offsets: Dict of note -> measured shift of the key from its nominal
+        position, in the units of OCTAVE_WIDTH (about millimeters).
+    left, right: Where the left edge of the lowest key and the right edge of
+        the highest key are on the canvas, as fractions of its width.
+    keystone: How much wider the projected image is at the top of the canvas
+        than at its bottom, as a fraction of its width at the bottom. The
+        keys and bars are narrowed (or widened) to compensate, around the
+        center of the canvas.
+  """
+
+  def __init__(self, name='61 keys', lowest_note=36, highest_note=96,
+               key_offsets=None, left=0.0, right=1.0, keystone=0.0):
+    self.name = name
+    self.lowest_note = lowest_note
+    self.highest_note = highest_note
+    self.key_offsets = dict(key_offsets or {})
+    self.left = left
+    self.right = right
+    self.keystone = keystone
+
+  def ToDict(self):
+    return {'name': self.name,
+            'lowest_note': self.lowest_note,
+            'highest_note': self.highest_note,
+            # JSON object keys are strings.
+            'key_offsets': dict((str(note), offset)
+                                for note, offset in self.key_offsets.items()),
+            'left': self.left,
+            'right': self.right,
+            'keystone': self.keystone}
+
+  @classmethod
+  def FromDict(cls, values):
+    values = dict(values)
+    values['key_offsets'] = dict(
+        (int(note), float(offset))
+        for note, offset in values.get('key_offsets', {}).iteritems())
+    profile = cls(**values)
+    profile.Validate()
+    return profile
+
+  def Validate(self):
+    if not 0 <= self.lowest_note < self.highest_note < NUM_NOTES:
+      raise ValueError('Invalid key range %d-%d' % (self.lowest_note,
+                                                    self.highest_note))
+    if self.left >= self.right:
+      raise ValueError('Invalid canvas range %f-%f' % (self.left, self.right))
+    if self.keystone <= -1:
+      raise ValueError('Invalid keystone %f' % self.keystone)
+
+
+def PresetProfile(num_keys):
+  """Returns the uncalibrated profile of a keyboard with |num_keys| keys."""
+  if num_keys not in KEY_RANGES:
+    raise ValueError('Unknown keyboard size %d, expected one of %s' % (
+        num_keys, sorted(KEY_RANGES)))
+  lowest_note, highest_note = KEY_RANGES[num_keys]
+  return CalibrationProfile('%d keys' % num_keys, lowest_note, highest_note)
+
+
+def LoadProfile(fname):
+  """Reads a CalibrationProfile saved by SaveProfile. Raises IOError if the
+  file cannot be read, and ValueError if it is invalid."""
+  with open(fname) as f:
+    try:
+      return CalibrationProfile.FromDict(json.load(f))
+    except TypeError as e:
+      raise ValueError('Invalid calibration profile %s: %s' % (fname, e))
+
+
+def SaveProfile(profile, fname):
+  with open(fname, 'w') as f:
+    json.dump(profile.ToDict(), f, indent=2, sort_keys=True)
+
+
+class KeyGeometry(object):
+  """Horizontal extent of each key and note bar on the canvas.
+
+  All intervals are computed once, so that drawing a key or a bar takes a
+  single lookup. Tables are indexed by midi note, and hold (x1, x2) canvas
+  coordinates.
+
+  Attributes:
+    canvas_width, canvas_height, keyboard_height: Canvas layout, in pixels.
+    profile: CalibrationProfile of the keyboard.
+    keys: Intervals of the keys.
+    wide_keys: Intervals of the wide keys (black keys as wide as white ones),
+        used for key highlights.
+    bars: Intervals of the note bars, which line up with the wide keys at
+        the top of the keyboard.
+  """
+
+  def __init__(self, canvas_width, canvas_height, keyboard_height,
+               profile=None):
+    self.canvas_width = canvas_width
+    self.canvas_height = canvas_height
+    self.keyboard_height = keyboard_height
+    self.profile = profile or CalibrationProfile()
+    keyboard_top = canvas_height - keyboard_height
+    black_key_y = (keyboard_top + canvas_height - BLACK_KEY_GAP) / 2.0
+    white_key_y = (keyboard_top + canvas_height) / 2.0
+    self.keys = [
+        self._ScreenInterval(note, False, white_key_y
+                             if note % 12 in WHITE_NOTES else black_key_y)
+        for note in xrange(NUM_NOTES)]
+    self.wide_keys = [
+        self._ScreenInterval(note, True, white_key_y
+                             if note % 12 in WHITE_NOTES else black_key_y)
+        for note in xrange(NUM_NOTES)]
+    self.bars = [self._ScreenInterval(note, True, keyboard_top)
+                 for note in xrange(NUM_NOTES)]
+
+  def _ScreenInterval(self, note, wide, y):
+    """Returns the canvas interval of |note| at height |y| of the canvas."""
+    profile = self.profile
+    min_x = noteToPhysicalInterval(profile.lowest_note, False)[0]
+    max_x = noteToPhysicalInterval(profile.highest_note, False)[1]
+    scale_x = (float(self.canvas_width) * (profile.right - profile.left) /
+               (max_x - min_x))
+    offset = profile.key_offsets.get(note, 0.0)
+    interval = noteToPhysicalInterval(note, wide)
+    x1, x2 = [profile.left * self.canvas_width + (x + offset - min_x) * scale_x
+              for x in interval]
+    if profile.keystone:
+      # The image at height y is 1 + keystone * (1 - y / height) times as
+      # wide as at the bottom of the canvas.
+      center = self.canvas_width / 2.0
+      stretch = 1.0 + profile.keystone * (1.0 - float(y) / self.canvas_height)
+      x1, x2 = [center + (x - center) / stretch for x in (x1, x2)]
+    return (x1, x2)
+
+
+def main():
+  if len(sys.argv) != 3:
+    print __doc__.split('\n\n')[1]
+    sys.exit(1)
+  SaveProfile(PresetProfile(int(sys.argv[1])), sys.argv[2])
+
+
+if __name__ == '__main__':
+  main()
@@ -14,8 +14,6 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
-import time
-
 import piano_input
 import piano_output
 
@@ -63,9 +61,9 @@ class Keyboard(object):
     text_widget = self.piano_output.SetKeyText(
         65, self.piano_output.KEYBOARD_HEIGHT + 50, '')
     while True:
-      while self.piano_input.user_input.empty():
-        time.sleep(0.1)
+      self.piano_output.WaitForInput(self.piano_input.user_input)
       user_cmd = self.piano_input.user_input.get()
+      self.piano_output.input_latency.Processed(user_cmd[2])
       if user_cmd[1] == 0:
         continue
       note_pressed = user_cmd[0]
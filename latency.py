@@ -0,0 +1,128 @@
+"""Measurement of the latency between piano input and its handling.
+
+Copyright 2015 Google Inc. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import math
+import sys
+
+import clock
+
+
+class LatencyHistogram(object):
+  """Histogram of latencies, with logarithmically sized buckets.
+
+  Bucket 0 counts latencies below MIN_SECONDS, and bucket i > 0 those in
+  [MIN_SECONDS * RATIO**(i - 1), MIN_SECONDS * RATIO**i). Percentiles are
+  estimated by the upper bound of their bucket, so they are at most RATIO
+  times the exact value. The last bucket also counts all larger latencies.
+
+  Attributes:
+    counts: List of the number of latencies in each bucket.
+    count: Total number of latencies.
+    max_seconds: Largest latency.
+  """
+
+  MIN_SECONDS = 1e-4
+  RATIO = 1.05
+  NUM_BUCKETS = 300  # The last bucket starts at about 220 seconds.
+
+  def __init__(self):
+    self.counts = [0] * self.NUM_BUCKETS
+    self.count = 0
+    self.max_seconds = 0.0
+
+  def Add(self, seconds):
+    if seconds < self.MIN_SECONDS:
+      bucket = 0
+    else:
+      bucket = min(self.NUM_BUCKETS - 1, 1 + int(
+          math.log(seconds / self.MIN_SECONDS) / math.log(self.RATIO)))
+    self.counts[bucket] += 1
+    self.count += 1
+    self.max_seconds = max(self.max_seconds, seconds)
+
+  def Percentile(self, fraction):
+    """Returns the latency (in seconds) below which |fraction| of the
+    latencies fall, or None if there are none."""
+    if not self.count:
+      return None
+    rank = fraction * self.count
+    total = 0
+    for bucket, count in enumerate(self.counts):
+      total += count
+      if total >= rank and count:
+        return min(self.max_seconds, self.MIN_SECONDS * self.RATIO**bucket)
+    return self.max_seconds
+
+  def Summary(self):
+    """Returns a dict with the count, p50, p95, p99 and max latencies."""
+    return {'count': self.count,
+            'p50': self.Percentile(0.50),
+            'p95': self.Percentile(0.95),
+            'p99': self.Percentile(0.99),
+            'max': self.max_seconds}
+
+
+class InputLatency(object):
+  """Latency of piano input events, from their capture timestamp to their
+  processing by the application, and to the next display refresh after that.
+
+  Attributes:
+    clock: clock.MonotonicClock; must match the clock timestamping input.
+    processed: LatencyHistogram of the capture to processing latencies.
+    displayed: LatencyHistogram of the capture to display latencies.
+    latest: Capture timestamp of the last processed event, or None.
+  """
+
+  def __init__(self, clock_obj=None):
+    self.clock = clock_obj or clock.MonotonicClock()
+    self.processed = LatencyHistogram()
+    self.displayed = LatencyHistogram()
+    self._pending = []  # Timestamps of processed events not displayed yet.
+    self.latest = None
+
+  def Processed(self, timestamp):
+    """Records the processing of an input event captured at |timestamp|."""
+    self.processed.Add(max(0.0, self.clock.Now() - timestamp))
+    self._pending.append(timestamp)
+    self.latest = timestamp
+
+  def Displayed(self):
+    """Records that all processed input events are now on screen."""
+    if not self._pending:
+      return
+    now = self.clock.Now()
+    for timestamp in self._pending:
+      self.displayed.Add(max(0.0, now - timestamp))
+    self._pending = []
+
+  def Summary(self):
+    return {'processed': self.processed.Summary(),
+            'displayed': self.displayed.Summary()}
+
+  def Print(self, out=sys.stdout):
+    """Prints the percentiles of both latencies, in milliseconds."""
+    for name, histogram in (('processed', self.processed),
+                            ('displayed', self.displayed)):
+      summary = histogram.Summary()
+      if not summary['count']:
+        print >>out, 'Input latency to %s: no events' % name
+        continue
+      print >>out, ('Input latency to %s: %d events, p50 %.1f ms, '
+                    'p95 %.1f ms, p99 %.1f ms, max %.1f ms' % (
+                        name, summary['count'], summary['p50'] * 1000,
+                        summary['p95'] * 1000, summary['p99'] * 1000,
+                        summary['max'] * 1000))
@@ -15,8 +15,16 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import array
+import bisect
+import heapq
+import mmap
+import os
 import struct
 
+# Delay (in ticks) added before the first event of every track.
+START_DELAY = 300
+
 
 def ReadInt32(b):
   return struct.unpack('>i', b)[0]
@@ -30,19 +38,19 @@ def ReadInt16(b):
   return struct.unpack('>h', b)[0]
 
 
-def ReadInt8(b):
-  return ord(b[0])
+def ReadInt8(b, offset=0):
+  return ord(b[offset])
 
 
-def ReadVarLen(b):
-  """Reads a MIDI variable-length int.
+def ReadVarLen(b, offset=0):
+  """Reads a MIDI variable-length int starting at |offset|.
   Returns a tuple specifying the int, and the number of bytes read."""
-  val = ReadInt8(b[0])
+  val = ReadInt8(b, offset)
   bytes_read = 1
   if val & 0x80:
     val &= 0x7f
     while True:
-      next_byte = ReadInt8(b[bytes_read])
+      next_byte = ReadInt8(b, offset + bytes_read)
       bytes_read += 1
       val = (val << 7) | (next_byte & 0x7f)
       if not next_byte & 0x80:
@@ -80,7 +88,10 @@ class MidiHeader(MidiChunk):
     self.num_tracks = ReadInt16(self.data[2:4])
     print 'This is a Format %d MIDI file' % self.format
     division = ReadInt16(self.data[4:])
-    if division & 0x8000:
+    # With SMPTE timing, ticks have a fixed duration and tempo events are
+    # irrelevant.
+    self.smpte_timing = bool(division & 0x8000)
+    if self.smpte_timing:
       self.ticks_per_note = (division & 0x00ff)
       self.notes_per_sec = (division & 0x7f00) >> 8
       print 'Ticks per frame: %d' % self.ticks_per_note
@@ -94,35 +105,106 @@ class MidiHeader(MidiChunk):
     assert self.id == 'MThd'
 
 
+def ScanChunks(file):
+  """Reads the headers of all chunks from the current position of |file| to
+  its end, skipping their data. Returns a list of (id, offset, length) where
+  |offset| is the position of the chunk data in the file."""
+  chunks = []
+  while True:
+    header = file.read(8)
+    if len(header) < 8:
+      return chunks
+    length = ReadInt32(header[4:])
+    chunks.append((header[:4], file.tell(), length))
+    file.seek(length, os.SEEK_CUR)
+
+
+def GetTempo(event):
+  """Returns the microseconds per quarter note set by a tempo meta event, or
+  None if |event| is not a valid tempo event."""
+  if event.cmd == 0xff and event.type == 0x51 and len(event.data) == 3:
+    usec_per_note = ReadInt24(event.data)
+    if usec_per_note > 0:
+      return usec_per_note
+  return None
+
+
+def DecodeEvents(b, start, end, skip_ignores=True, tempo_events=None):
+  """Decodes the events of a track stored in b[start:end].
+
+  |b| can be any buffer supporting indexing, e.g. a string or an mmap.
+  Yields MidiEvent objects. START_DELAY is added to the delta of the first
+  event. If |skip_ignores| is set, ignore_me events are skipped, but their
+  delta is kept. If |tempo_events| is a list, (time, usec_per_quarter_note)
+  is appended to it for every tempo event (including skipped ones), where
+  |time| does not include START_DELAY.
+  """
+  pos = start
+  cur_time = 0
+  skipped_delta = 0
+  first = True
+  prev_event = None
+  while pos < end:
+    event = MidiEvent()
+    # Events are decoded in place at |pos|; slicing the remaining data for
+    # every event would make parsing quadratic in track length.
+    pos += event.Read(b, prev_event, pos)
+    prev_event = event
+    cur_time += event.delta
+    if tempo_events is not None:
+      usec_per_note = GetTempo(event)
+      if usec_per_note:
+        tempo_events.append((cur_time, usec_per_note))
+    if skip_ignores and event.ignore_me and pos < end:
+      # Skip the event, but keep its delta.
+      skipped_delta += event.delta
+      continue
+    event.delta += skipped_delta
+    skipped_delta = 0
+    if first:
+      event.delta += START_DELAY  # Add a delay before the song starts.
+      first = False
+    yield event
+
+
 class MidiTrack(MidiChunk):
   """Contains a music track (a list of events).
 
   Attributes (in addition to inherited attributes):
-    events: List of MidiEvent objects.
+    events: List of MidiEvent objects, or a MidiEventColumns object if the
+        track was read in compact mode.
+    tempo_events: List of (time, usec_per_quarter_note) for every tempo meta
+        event in the track, including skipped ones. |time| is in ticks since
+        the start of the track, not including START_DELAY.
+
+  The chunk data is only needed while decoding the events, so it is not kept.
   """
 
-  def __init__(self, file, skip_ignores=True):
+  def __init__(self, file, skip_ignores=True, compact=False):
     super(MidiTrack, self).__init__(file)
-    self.events = []
-    bytes_read = 0
-    prev_event = None
-    while bytes_read < len(self.data):
-      event = MidiEvent()
-      if skip_ignores:
-        bytes_read += event.ReadSkippingIgnores(self.data[bytes_read:],
-                                                prev_event)
-      else:
-        bytes_read += event.Read(self.data[bytes_read:], prev_event)
-      if len(self.events) == 0:
-        event.delta += 300  # Add a delay before the song starts.
+    self.events = MidiEventColumns() if compact else []
+    self.tempo_events = []
+    for event in DecodeEvents(self.data, 0, len(self.data), skip_ignores,
+                              self.tempo_events):
       self.events.append(event)
-      prev_event = event
+    del self.data
     print 'Read track with %d events' % len(self.events)
 
   def Validate(self):
     assert self.id == 'MTrk'
 
 
+def _ReadTrack(args):
+  """Reads the track chunk at |offset| of a file. Runs in a worker process
+  when tracks are read in parallel."""
+  fname, offset, skip_ignores, compact = args
+  with open(fname) as file:
+    file.seek(offset)
+    track = MidiTrack(file, skip_ignores=skip_ignores, compact=compact)
+  track.Validate()
+  return track
+
+
 class MidiEvent(object):
   """Represents a single event, such as note-on or note-off.
 
@@ -168,63 +250,393 @@ class MidiEvent(object):
       return NAMES[cmd]
     return '  %02X   ' % cmd
 
-  def ReadSkippingIgnores(self, b, prev_event):
-    """Read event from byte string, skipping ignore_me events, but keeping
-    their delta. Returns total number of bytes read."""
-    total_bytes_read = self.Read(b, prev_event)
-    while self.ignore_me and total_bytes_read < len(b):
-      total_bytes_read += self.Read(b[total_bytes_read:], self)
+  def ReadSkippingIgnores(self, b, prev_event, offset=0):
+    """Read event from byte string at |offset|, skipping ignore_me events, but
+    keeping their delta. Returns total number of bytes read."""
+    total_bytes_read = self.Read(b, prev_event, offset)
+    skipped_delta = 0
+    while self.ignore_me and offset + total_bytes_read < len(b):
+      skipped_delta += self.delta
+      total_bytes_read += self.Read(b, self, offset + total_bytes_read)
+    self.delta += skipped_delta
     return total_bytes_read
 
-  def Read(self, b, prev_event):
-    """Read event from byte string. Returns the number of bytes read."""
-    self.delta, bytes_read = ReadVarLen(b)
-    self.raw_cmd = ReadInt8(b[bytes_read])
-    bytes_read += 1
+  def Read(self, b, prev_event, offset=0):
+    """Read event from byte string at |offset|.
+    Returns the number of bytes read."""
+    self.delta, bytes_read = ReadVarLen(b, offset)
+    pos = offset + bytes_read
+    # Not stored yet: |prev_event| may be this event, when it is read again
+    # by ReadSkippingIgnores.
+    raw_cmd = ReadInt8(b, pos)
+    pos += 1
 
     # Parse ordinary events
     self.ignore_me = False
-    if not self.raw_cmd & 0x80:
+    if not raw_cmd & 0x80:
       # Push back the command, as we are actually using the command from the
       # previous event.
-      bytes_read -= 1
-      self.raw_cmd = prev_event.raw_cmd
+      pos -= 1
+      raw_cmd = prev_event.raw_cmd
+    self.raw_cmd = raw_cmd
 
     self.cmd = self.raw_cmd
 
     if self.cmd == 0xff:
       self.ignore_me = True
-      self.type = ReadInt8(b[bytes_read])
-      bytes_read += 1
-      cmd_len, l = ReadVarLen(b[bytes_read:])
-      bytes_read += l
-      self.data = b[bytes_read:bytes_read+cmd_len]
-      bytes_read += cmd_len  # Skip entire message
-      return bytes_read
-    if self.cmd == 0xf0:
+      self.type = ReadInt8(b, pos)
+      pos += 1
+      cmd_len, l = ReadVarLen(b, pos)
+      pos += l
+      self.data = b[pos:pos+cmd_len]
+      pos += cmd_len  # Skip entire message
+      return pos - offset
+    if self.cmd in (0xf0, 0xf7):
+      # System exclusive message (or continuation of one). Its data, including
+      # the terminating 0xF7, is preceded by its length.
       self.ignore_me = True
-      while not (ReadInt8(b[bytes_read]) == 0xF7):
-        bytes_read += 1
-      return bytes_read
+      cmd_len, l = ReadVarLen(b, pos)
+      pos += l + cmd_len  # Skip entire message
+      return pos - offset
 
     if (self.cmd & 0xf0) in (0xd0, 0xc0):
       self.ignore_me = True
-      bytes_read += 1  # Skip one byte
+      pos += 1  # Skip one byte
     elif (self.cmd & 0xf0) in (0x80, 0x90):
       # Note-off (0x80) or note-on (0x90) command
       self.channel = self.cmd & 0x0f;
       self.cmd = self.cmd & 0xf0;
-      self.note = ReadInt8(b[bytes_read])
-      self.volume = ReadInt8(b[bytes_read + 1])
-      bytes_read += 2
+      self.note = ReadInt8(b, pos)
+      self.volume = ReadInt8(b, pos + 1)
+      pos += 2
       if self.volume == 0:
         self.cmd = 0x80  # Some midi files use volume 0 to indicate note-off
     else:
       # Unknown command - ignored
-      bytes_read += 2
+      pos += 2
       self.ignore_me = True
 
-    return bytes_read
+    return pos - offset
+
+
+class MidiEventColumns(object):
+  """Compact, array-backed store for the events of a track.
+
+  Behaves like a read-only list of MidiEvent objects, but keeps one entry per
+  event in parallel arrays instead of a full Python object per event. Meta
+  events keep their type and payload in a side table. Indexing builds a
+  MidiEvent on the fly.
+
+  Attributes:
+    delta: array of event deltas, in ticks.
+    time: array of absolute event times, in ticks since start of track.
+    cmd, raw_cmd, channel, note, volume: arrays holding the MidiEvent
+        attributes of the same names.
+    ignore_me: array of flags (0 or 1), as in MidiEvent.ignore_me.
+    meta: Dict mapping event index to (type, data) for meta (0xff) events.
+  """
+
+  def __init__(self):
+    self.delta = array.array('i')
+    self.time = array.array('i')
+    self.cmd = array.array('h')
+    self.raw_cmd = array.array('h')
+    self.channel = array.array('h')
+    self.note = array.array('h')
+    self.volume = array.array('h')
+    self.ignore_me = array.array('B')
+    self.meta = {}
+
+  @staticmethod
+  def FromEvents(events):
+    columns = MidiEventColumns()
+    for event in events:
+      columns.append(event)
+    return columns
+
+  def append(self, event, delta=None):
+    """Appends a copy of |event|. If |delta| is given, it replaces the delta
+    of the event."""
+    if delta is None:
+      delta = event.delta
+    if len(self.time):
+      self.time.append(self.time[-1] + delta)
+    else:
+      self.time.append(delta)
+    if event.cmd == 0xff:
+      self.meta[len(self.delta)] = (event.type, event.data)
+    self.delta.append(delta)
+    self.cmd.append(event.cmd)
+    self.raw_cmd.append(event.raw_cmd)
+    self.channel.append(event.channel)
+    self.note.append(event.note)
+    self.volume.append(event.volume)
+    self.ignore_me.append(event.ignore_me)
+
+  def __len__(self):
+    return len(self.delta)
+
+  def __getitem__(self, i):
+    if i < 0:
+      i += len(self.delta)
+    event = MidiEvent()
+    event.delta = self.delta[i]
+    event.cmd = self.cmd[i]
+    event.raw_cmd = self.raw_cmd[i]
+    event.channel = self.channel[i]
+    event.note = self.note[i]
+    event.volume = self.volume[i]
+    event.ignore_me = bool(self.ignore_me[i])
+    if event.cmd == 0xff:
+      event.type, event.data = self.meta[i]
+    return event
+
+  def __iter__(self):
+    for i in xrange(len(self.delta)):
+      yield self[i]
+
+  def DiscardFirst(self, count):
+    """Removes the first |count| events."""
+    for name in self._COLUMNS:
+      del getattr(self, name)[:count]
+    self.meta = dict((i - count, meta) for i, meta in self.meta.iteritems()
+                     if i >= count)
+
+  _COLUMNS = ('delta', 'time', 'cmd', 'raw_cmd', 'channel', 'note', 'volume',
+              'ignore_me')
+
+  def __getstate__(self):
+    # Pickle the arrays as raw bytes; the default pickles them as lists.
+    state = dict((name, getattr(self, name).tostring())
+                 for name in self._COLUMNS)
+    state['meta'] = self.meta
+    return state
+
+  def __setstate__(self, state):
+    self.__init__()
+    for name in self._COLUMNS:
+      getattr(self, name).fromstring(state[name])
+    self.meta = state['meta']
+
+
+class TempoMap(object):
+  """Converts between song time in ticks and in seconds.
+
+  Built once from the tempo changes of a song; every lookup is a binary search
+  over the change times.
+
+  Attributes:
+    changes: List of (time, tempo) where |time| is in ticks and |tempo| is the
+        number of ticks per second, sorted by time. The first change is at
+        time 0.
+  """
+
+  def __init__(self, changes):
+    self.changes = []
+    for start_time, tempo in sorted(changes, key=lambda change: change[0]):
+      if self.changes and self.changes[-1][0] == start_time:
+        self.changes[-1] = (start_time, tempo)  # Later change wins.
+      else:
+        self.changes.append((start_time, tempo))
+    assert self.changes and self.changes[0][0] == 0
+    self._times = [start_time for start_time, _ in self.changes]
+    self._tempos = [tempo for _, tempo in self.changes]
+    # Seconds elapsed at the time of each change.
+    self._seconds = [0.0]
+    for i in xrange(1, len(self.changes)):
+      self._seconds.append(self._seconds[-1] + float(
+          self._times[i] - self._times[i - 1]) / self._tempos[i - 1])
+
+  def Append(self, time, tempo):
+    """Adds a tempo change at or after the last known one. Changes before the
+    last known one are assumed to be known already, and are ignored."""
+    if time < self._times[-1]:
+      return
+    if time == self._times[-1]:
+      self._tempos[-1] = tempo
+      self.changes[-1] = (time, tempo)
+      return
+    self._seconds.append(self._seconds[-1] + float(
+        time - self._times[-1]) / self._tempos[-1])
+    self._times.append(time)
+    self._tempos.append(tempo)
+    self.changes.append((time, tempo))
+
+  def GetTicksPerSec(self, time):
+    """Get the tempo (in ticks per sec) at the specified time (in ticks)."""
+    return self._tempos[max(0, bisect.bisect_right(self._times, time) - 1)]
+
+  def TicksToSeconds(self, time):
+    """Converts a time in ticks (possibly fractional) to seconds."""
+    i = max(0, bisect.bisect_right(self._times, time) - 1)
+    return self._seconds[i] + (time - self._times[i]) / self._tempos[i]
+
+  def SecondsToTicks(self, seconds):
+    """Converts a time in seconds to a (fractional) time in ticks."""
+    i = max(0, bisect.bisect_right(self._seconds, seconds) - 1)
+    return self._times[i] + (seconds - self._seconds[i]) * self._tempos[i]
+
+
+def _TimedEvents(track_index, events, notes_only=True):
+  """Yields (time, track_index, ordinal, event) for the events of a track,
+  or only for its note events if |notes_only| is set. Used as the sort key
+  of the k-way merges in MidiTimeline and StreamingTimeline."""
+  cur_time = 0
+  for i, event in enumerate(events):
+    cur_time += event.delta
+    if not notes_only or (not event.ignore_me and event.cmd in (0x80, 0x90)):
+      yield cur_time, track_index, i, event
+
+
+class MidiTimeline(object):
+  """The note events of all tracks of a song, merged into one time-ordered
+  stream. Simultaneous events are ordered by track, then by their order
+  within the track.
+
+  A (track, channel) pair is called a part. Parts can be selected without
+  merging the tracks again, e.g. to play only one hand of a piano piece.
+
+  Attributes:
+    events: MidiEventColumns holding the merged note events.
+    track: array with the index of the track of each event.
+  """
+
+  def __init__(self, tracks):
+    self.events = MidiEventColumns()
+    self.track = array.array('h')
+    prev_time = 0
+    for cur_time, track_index, _, event in heapq.merge(
+        *[_TimedEvents(i, track.events) for i, track in enumerate(tracks)]):
+      self.events.append(event, delta=cur_time - prev_time)
+      self.track.append(track_index)
+      prev_time = cur_time
+
+  def Parts(self):
+    """Returns a list of (track, channel, num_notes, mean_note) for every
+    part playing at least one note, sorted by mean_note."""
+    counts = {}
+    for i in xrange(len(self.events)):
+      if self.events.cmd[i] == 0x90:
+        part = (self.track[i], self.events.channel[i])
+        num_notes, note_sum = counts.get(part, (0, 0))
+        counts[part] = (num_notes + 1, note_sum + self.events.note[i])
+    return sorted(
+        [(track, channel, num_notes, float(note_sum) / num_notes)
+         for (track, channel), (num_notes, note_sum) in counts.iteritems()],
+        key=lambda part: part[3])
+
+  def HandParts(self, hand):
+    """Returns the set of (track, channel) parts played by |hand|.
+
+    |hand| is 'left', 'right' or 'both'. Percussion (channel 10) is never
+    included. Parts are split by mean pitch: the lower half of the parts is
+    played by the left hand, the upper half by the right hand. A song with a
+    single part plays it with either hand.
+    """
+    parts = self._HandParts()
+    if hand == 'both' or len(parts) < 2:
+      return set(parts)
+    if hand == 'left':
+      return set(parts[:len(parts) / 2])
+    return set(parts[len(parts) / 2:])
+
+  def SplitsHands(self):
+    """Returns whether the left and right hands play different parts, i.e.
+    whether the song has at least two parts besides percussion."""
+    return len(self._HandParts()) >= 2
+
+  def _HandParts(self):
+    """Returns the (track, channel) parts played by hands, sorted by mean
+    pitch."""
+    return [(track, channel) for track, channel, _, _ in self.Parts()
+            if channel != 9]
+
+  def Select(self, parts):
+    """Returns a MidiEventColumns with the events of the given (track, channel)
+    parts only."""
+    selected = MidiEventColumns()
+    prev_time = 0
+    for i in xrange(len(self.events)):
+      if (self.track[i], self.events.channel[i]) in parts:
+        cur_time = self.events.time[i]
+        selected.append(self.events[i], delta=cur_time - prev_time)
+        prev_time = cur_time
+    return selected
+
+
+class StreamingTimeline(object):
+  """The merged note events of a lazily loaded MidiFile, decoded in bounded
+  batches as playback gets near them.
+
+  Event indices are absolute, as if all events were kept in one list, but
+  only the events from |base| on are held in memory. Tempo changes are added
+  to the tempo map of the midi file as they are decoded. As with
+  MidiTimeline.HandParts('both'), percussion (channel 10) is left out.
+
+  Attributes:
+    midi_file: The lazily loaded MidiFile.
+    batch_size: Number of note events decoded at once.
+    window: MidiEventColumns holding the decoded events not discarded yet.
+    base: Absolute index of the first event in window.
+    done: Whether all events of the song have been decoded.
+  """
+
+  def __init__(self, midi_file, batch_size=1024):
+    self.midi_file = midi_file
+    self.batch_size = batch_size
+    self.Rewind()
+
+  def Rewind(self):
+    """Restarts decoding from the start of the song."""
+    self.window = MidiEventColumns()
+    self.base = 0
+    self.done = False
+    self._prev_time = 0
+    self._stream = heapq.merge(*[
+        _TimedEvents(i, DecodeEvents(self.midi_file.buffer, offset,
+                                     offset + length, skip_ignores=False),
+                     notes_only=False)
+        for i, (_, offset, length) in enumerate(self.midi_file.chunks)])
+
+  def __len__(self):
+    return self.base + len(self.window)
+
+  def __getitem__(self, i):
+    return self.window[i - self.base]
+
+  def DecodeUntil(self, time):
+    """Decodes events until one later than |time| (in ticks) is known, or the
+    song has ended."""
+    while not self.done and (
+        not len(self.window) or self.window.time[-1] <= time):
+      self._DecodeBatch()
+
+  def Discard(self, index):
+    """Frees the events before absolute |index|. The last decoded event is
+    always kept."""
+    count = min(index - self.base, len(self.window) - 1)
+    if count >= self.batch_size:  # Amortize the cost of shifting the arrays.
+      self.window.DiscardFirst(count)
+      self.base += count
+
+  def _DecodeBatch(self):
+    count = 0
+    for cur_time, _, _, event in self._stream:
+      if event.ignore_me:
+        usec_per_note = GetTempo(event)
+        if usec_per_note and not self.midi_file.header.smpte_timing:
+          # The first event of each track is START_DELAY ticks late; tempo
+          # events at the start of the song also cover that delay.
+          self.midi_file.tempo.Append(
+              cur_time if cur_time > START_DELAY else 0,
+              self.midi_file.TicksPerSecForTempo(usec_per_note))
+      elif event.cmd in (0x80, 0x90) and event.channel != 9:
+        self.window.append(event, delta=cur_time - self._prev_time)
+        self._prev_time = cur_time
+        count += 1
+        if count >= self.batch_size:
+          return
+    self.done = True
 
 
 class MidiFile(object):
@@ -236,10 +648,24 @@ class MidiFile(object):
     tempo_map: List of (time, tempo) where |time| is in ticks and |tempo| is the
         number of ticks per second. Each tempo is valid starting at the time
         specified by |time|.
+    tempo: TempoMap object built from tempo_map.
+    lazy: Whether the file was loaded lazily. A lazily loaded file has no
+        tracks; its events are decoded by the StreamingTimeline objects
+        returned by GetTimeline(), which also extend the tempo map.
+    chunks: For lazily loaded files, (id, offset, length) of the track chunks.
+    buffer: For lazily loaded files, a read-only mmap of the file.
   """
 
-  def __init__(self, fname):
-    """Read a midi file to memory."""
+  _timeline = None
+  lazy = False
+
+  def __init__(self, fname, compact=False, lazy=False, pool=None):
+    """Read a midi file to memory.
+    If |compact| is set, track events are kept in MidiEventColumns objects.
+    If |lazy| is set, only the chunk headers are read.
+    If |pool| is a multiprocessing.Pool, tracks are decoded concurrently in
+    its worker processes."""
+    self.lazy = lazy
     with open(fname) as file:
       self.header = MidiHeader(file)
       self.header.Validate()
@@ -247,33 +673,68 @@ class MidiFile(object):
       self.tempo_map = [
           (0, self.header.ticks_per_note*self.header.notes_per_sec)]
       print 'Midi file contains %d tracks' % self.header.num_tracks
-      for i in xrange(self.header.num_tracks):
-        skip_ignores = True
-        if self.header.format == 1 and i == 0:
-          skip_ignores = False
-        track = MidiTrack(file, skip_ignores=skip_ignores)
-        track.Validate()
-        self.tracks.append(track)
-      if self.header.format == 1:
-        tempo_map_track = self.tracks[0]
-        cur_time = 0
-        for event in tempo_map_track.events:
-          cur_time += event.delta
-          if event.cmd == 0xff and event.type == 0x51:
-            tempo = ReadInt24(event.data) / 1.e6
-            notes_per_sec = 1.0 / tempo
-            print 'Time %d: Found tempo %.6f' % (cur_time, tempo)
-            print 'Deduced notes per sec: %.2f' % notes_per_sec
-            self.tempo_map.append(
-                (cur_time, self.header.ticks_per_note*notes_per_sec))
+      # Chunks of unknown types are skipped.
+      chunks = [chunk for chunk in ScanChunks(file)
+                if chunk[0] == 'MTrk'][:self.header.num_tracks]
+      if lazy:
+        self.chunks = chunks
+        self.buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+      elif pool and len(chunks) > 1:
+        # Running status does not carry across chunks, so each track can be
+        # decoded on its own, starting from the offset of its chunk.
+        self.tracks = pool.map(_ReadTrack, [
+            (fname, offset - 8, self._SkipIgnores(i), compact)
+            for i, (_, offset, _) in enumerate(chunks)])
+      else:
+        for i, (_, offset, _) in enumerate(chunks):
+          file.seek(offset - 8)
+          track = MidiTrack(file, skip_ignores=self._SkipIgnores(i),
+                            compact=compact)
+          track.Validate()
+          self.tracks.append(track)
+      if not self.header.smpte_timing:
+        self._AddTempoEvents()
+    self.tempo = TempoMap(self.tempo_map)
+    self.tempo_map = self.tempo.changes
     print 'Tempo map:'
     for start_time, tempo in self.tempo_map:
       print '  %7d ticks: Tempo=%f' % (start_time, tempo)
 
+  def _SkipIgnores(self, track_index):
+    """Whether ignore_me events are dropped when reading a track."""
+    return not (self.header.format == 1 and track_index == 0)
+
+  def _AddTempoEvents(self):
+    """Adds the tempo events of all tracks to the tempo map."""
+    tempo_events = []
+    for track in self.tracks:
+      tempo_events.extend(track.tempo_events)
+    # Sorting is stable, so simultaneous changes apply in track order.
+    tempo_events.sort(key=lambda tempo_event: tempo_event[0])
+    for cur_time, usec_per_note in tempo_events:
+      print 'Time %d: Found tempo %.6f' % (cur_time, usec_per_note / 1.e6)
+      # The tempo at the start of the song also applies to the delay added
+      # before it.
+      if cur_time > 0:
+        cur_time += START_DELAY
+      self.tempo_map.append(
+          (cur_time, self.TicksPerSecForTempo(usec_per_note)))
+
+  def TicksPerSecForTempo(self, usec_per_note):
+    """Converts the value of a tempo event to ticks per second."""
+    notes_per_sec = 1.0 / (usec_per_note / 1.e6)
+    return self.header.ticks_per_note*notes_per_sec
+
   def GetTicksPerSec(self, time):
     """Get the tempo (in ticks per sec) at the specified time (in ticks)."""
-    for start_time, tempo in self.tempo_map[::-1]:
-      if start_time <= time:
-        return tempo
-    return self.tempo_map[0][1]
+    return self.tempo.GetTicksPerSec(time)
+
+  def GetTimeline(self):
+    """Returns the MidiTimeline of all tracks, merging them on first use.
+    For lazily loaded files, returns a new StreamingTimeline instead."""
+    if self.lazy:
+      return StreamingTimeline(self)
+    if self._timeline is None:
+      self._timeline = MidiTimeline(self.tracks)
+    return self._timeline
 
@@ -0,0 +1,417 @@
+"""Benchmarks for loading MIDI files.
+
+Generates a corpus of synthetic MIDI files of controlled size and shape, and
+measures how fast midi.MidiFile loads them and how much memory it uses. The
+results can be saved as a baseline, and later runs compared against it.
+
+Usage:
+  python midi_benchmark.py run [--baseline FILE] [--save-baseline FILE]
+                               [--threshold FRACTION] [--compact]
+      Benchmarks loading of the synthetic corpus. Exits with status 1 if any
+      measurement is worse than the baseline by more than the threshold.
+  python midi_benchmark.py generate <out.mid> [--tracks N] [--events N]
+                                    [--running-status P] [--noise P]
+                                    [--tempo-changes N] [--seed N]
+      Writes a single synthetic MIDI file.
+  python midi_benchmark.py memory <file.mid> [<file.mid> ...]
+      Compares the memory used by the two in-memory representations of track
+      events: a list of midi.MidiEvent objects, and midi.MidiEventColumns.
+
+Copyright 2015 Google Inc. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import argparse
+import collections
+import json
+import os
+import random
+import resource
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import timeit
+
+import midi
+
+# Bump whenever the measurements stored in a baseline change meaning.
+BASELINE_VERSION = 1
+
+# Shape of a synthetic MIDI file.
+#   num_tracks: Number of tracks. Files with several tracks are format 1.
+#   events_per_track: Number of events in each track.
+#   running_status: Probability that a channel event which may use running
+#       status omits its status byte.
+#   noise: Probability that an event is a sysex, meta or controller event
+#       instead of a note event.
+#   tempo_changes: Number of tempo events, spread over the first track.
+CorpusSpec = collections.namedtuple('CorpusSpec', [
+    'name', 'num_tracks', 'events_per_track', 'running_status', 'noise',
+    'tempo_changes'])
+
+CORPUS = [
+    CorpusSpec('single_track', 1, 20000, 0.5, 0.02, 4),
+    CorpusSpec('many_tracks', 16, 2000, 0.5, 0.02, 4),
+    CorpusSpec('running_status', 1, 20000, 1.0, 0.0, 1),
+    CorpusSpec('no_running_status', 1, 20000, 0.0, 0.0, 1),
+    CorpusSpec('noisy', 2, 10000, 0.5, 0.4, 4),
+    CorpusSpec('tempo_changes', 2, 10000, 0.5, 0.02, 2000),
+]
+
+# Measurements compared against the baseline, all lower-is-better, along with
+# an absolute slack below which differences are treated as noise.
+COMPARED_MEASUREMENTS = (
+    ('header_sec', 0.001),
+    ('tracks_sec', 0.005),
+    ('tempo_sec', 0.001),
+    ('total_sec', 0.005),
+    ('peak_kb', 512),
+)
+
+
+def EncodeVarLen(value):
+  """Encodes an int as a MIDI variable-length quantity."""
+  encoded = [chr(value & 0x7f)]
+  value >>= 7
+  while value:
+    encoded.append(chr((value & 0x7f) | 0x80))
+    value >>= 7
+  return ''.join(reversed(encoded))
+
+
+def _NoiseEvent(rng):
+  """Returns the bytes (without delta) of a random event that the player
+  ignores, and whether it cancels running status."""
+  kind = rng.randrange(4)
+  if kind == 0:
+    data = ''.join(chr(rng.randrange(0x80)) for _ in xrange(rng.randint(2, 32)))
+    return '\xf0' + EncodeVarLen(len(data) + 1) + data + '\xf7', True
+  if kind == 1:
+    text = 'x' * rng.randint(1, 40)
+    return '\xff\x01' + EncodeVarLen(len(text)) + text, True
+  if kind == 2:
+    return chr(0xb0 | rng.randrange(16)) + chr(rng.randrange(0x80)) + chr(
+        rng.randrange(0x80)), False
+  return chr(0xc0 | rng.randrange(16)) + chr(rng.randrange(0x80)), False
+
+
+def SyntheticTrack(rng, num_events, running_status=0.5, noise=0.02,
+                   tempo_changes=0):
+  """Returns the bytes of a MTrk chunk with |num_events| random events, plus
+  an end-of-track event. See CorpusSpec for the meaning of the arguments."""
+  events = []
+  tempo_every = num_events / tempo_changes if tempo_changes else 0
+  status = None  # Running status, or None if cancelled.
+  playing = []
+  for i in xrange(num_events):
+    delta = EncodeVarLen(rng.choice((0, 0, 0, 10, 60, 120, 240, 1000)))
+    if tempo_every and i % tempo_every == 0:
+      usec_per_note = rng.randint(250000, 1000000)
+      events.append(
+          delta + '\xff\x51\x03' + struct.pack('>i', usec_per_note)[1:])
+      status = None
+      continue
+    if rng.random() < noise:
+      event, cancels_status = _NoiseEvent(rng)
+      events.append(delta + event)
+      status = None if cancels_status else ord(event[0])
+      continue
+    if playing and (len(playing) > 10 or rng.random() < 0.5):
+      # Note-on with volume 0 ends the note, and keeps running status.
+      channel, note = playing.pop(rng.randrange(len(playing)))
+      new_status, volume = 0x90 | channel, 0
+    else:
+      channel, note = rng.randrange(4), rng.randint(21, 108)
+      playing.append((channel, note))
+      new_status, volume = 0x90 | channel, rng.randint(1, 127)
+    if new_status == status and rng.random() < running_status:
+      events.append(delta + chr(note) + chr(volume))
+    else:
+      events.append(delta + chr(new_status) + chr(note) + chr(volume))
+    status = new_status
+  events.append('\x00\xff\x2f\x00')
+  data = ''.join(events)
+  return 'MTrk' + struct.pack('>i', len(data)) + data
+
+
+def WriteSyntheticFile(fname, spec, seed=0, ticks_per_note=480):
+  """Writes a MIDI file shaped after the CorpusSpec |spec|."""
+  rng = random.Random(seed)
+  with open(fname, 'wb') as f:
+    f.write('MThd' + struct.pack('>ihhh', 6, 0 if spec.num_tracks == 1 else 1,
+                                 spec.num_tracks, ticks_per_note))
+    for i in xrange(spec.num_tracks):
+      f.write(SyntheticTrack(rng, spec.events_per_track, spec.running_status,
+                             spec.noise, spec.tempo_changes if i == 0 else 0))
+
+
+def DeepSizeOf(obj, seen=None):
+  """Approximates the number of bytes used by |obj| and everything it refers
+  to. Objects shared between several references are only counted once."""
+  if seen is None:
+    seen = set()
+  if id(obj) in seen:
+    return 0
+  seen.add(id(obj))
+  size = sys.getsizeof(obj)
+  if isinstance(obj, dict):
+    for key, value in obj.iteritems():
+      size += DeepSizeOf(key, seen) + DeepSizeOf(value, seen)
+  elif isinstance(obj, (list, tuple, set, frozenset)):
+    for item in obj:
+      size += DeepSizeOf(item, seen)
+  elif hasattr(obj, '__dict__'):
+    size += DeepSizeOf(obj.__dict__, seen)
+  return size
+
+
+def EventsMemory(midi_file):
+  """Returns the number of bytes used by the events of all tracks."""
+  seen = set()
+  return sum(DeepSizeOf(track.events, seen) for track in midi_file.tracks)
+
+
+def RunQuietly(function, *args, **kwargs):
+  """Calls |function|, discarding the progress messages of the parser."""
+  stdout = sys.stdout
+  sys.stdout = open(os.devnull, 'w')
+  try:
+    return function(*args, **kwargs)
+  finally:
+    sys.stdout.close()
+    sys.stdout = stdout
+
+
+def LoadQuietly(fname, **kwargs):
+  """Loads a midi file, discarding the progress messages of the parser."""
+  return RunQuietly(midi.MidiFile, fname, **kwargs)
+
+
+def CompareMemory(fname):
+  objects = EventsMemory(LoadQuietly(fname))
+  columns = EventsMemory(LoadQuietly(fname, compact=True))
+  print '%-40s %10d bytes on disk' % (fname, os.path.getsize(fname))
+  print '  MidiEvent list:    %10d bytes' % objects
+  print '  MidiEventColumns:  %10d bytes (%.1fx smaller)' % (
+      columns, float(objects) / max(1, columns))
+
+
+def BestTime(function, repeat):
+  """Returns the shortest of |repeat| run times of |function|, in seconds."""
+  best = None
+  for _ in xrange(repeat):
+    start = timeit.default_timer()
+    function()
+    elapsed = timeit.default_timer() - start
+    if best is None or elapsed < best:
+      best = elapsed
+  return best
+
+
+def _ReadHeader(fname):
+  with open(fname, 'rb') as file:
+    return midi.MidiHeader(file)
+
+
+def _ReadTracks(fname, compact):
+  """Reads all chunks the way midi.MidiFile does, without building the tempo
+  map. Returns the number of decoded events."""
+  with open(fname, 'rb') as file:
+    header = midi.MidiHeader(file)
+    num_events = 0
+    for i in xrange(header.num_tracks):
+      # As in midi.MidiFile, the first track of a format 1 file keeps its
+      # ignore_me events.
+      skip_ignores = not (header.format == 1 and i == 0)
+      track = midi.MidiTrack(file, skip_ignores=skip_ignores, compact=compact)
+      num_events += len(track.events)
+  return num_events
+
+
+def PeakMemory(fname, compact):
+  """Returns the growth of the peak resident set size (in kilobytes) caused by
+  loading |fname|. Measured in a fresh process, since the peak of this one
+  only ever grows."""
+  command = [sys.executable, os.path.abspath(__file__), 'peak-memory', fname]
+  if compact:
+    command.append('--compact')
+  return int(subprocess.check_output(command).split()[-1])
+
+
+def BenchmarkFile(fname, compact=False, repeat=3):
+  """Measures the loading of a MIDI file. Returns a dict of measurements."""
+  num_events = RunQuietly(_ReadTracks, fname, compact)
+  tracks_sec = BestTime(lambda: RunQuietly(_ReadTracks, fname, compact),
+                        repeat)
+  midi_file = LoadQuietly(fname, compact=compact)
+  return {
+      'header_sec': BestTime(lambda: RunQuietly(_ReadHeader, fname), repeat),
+      'tracks_sec': tracks_sec,
+      'tempo_sec': BestTime(lambda: midi.TempoMap(midi_file.tempo_map),
+                            repeat),
+      'total_sec': BestTime(
+          lambda: LoadQuietly(fname, compact=compact), repeat),
+      'peak_kb': PeakMemory(fname, compact),
+      'events': num_events,
+      'events_per_sec': num_events / max(tracks_sec, 1e-9),
+  }
+
+
+def RunCorpus(corpus=CORPUS, compact=False, repeat=3):
+  """Generates and benchmarks every file of |corpus|. Returns a dict mapping
+  CorpusSpec names to the measurements of BenchmarkFile."""
+  results = {}
+  directory = tempfile.mkdtemp(prefix='midi_benchmark')
+  try:
+    for seed, spec in enumerate(corpus):
+      fname = os.path.join(directory, spec.name + '.mid')
+      WriteSyntheticFile(fname, spec, seed=seed)
+      results[spec.name] = BenchmarkFile(fname, compact=compact, repeat=repeat)
+      PrintResult(spec.name, results[spec.name])
+  finally:
+    shutil.rmtree(directory)
+  return results
+
+
+def PrintResult(name, result):
+  print '%-20s %7d events  header %7.3f ms  tracks %8.2f ms  tempo %7.3f ms' \
+      '  total %8.2f ms  %8.0f events/s  peak %6d kB' % (
+          name, result['events'], result['header_sec'] * 1000,
+          result['tracks_sec'] * 1000, result['tempo_sec'] * 1000,
+          result['total_sec'] * 1000, result['events_per_sec'],
+          result['peak_kb'])
+
+
+def CompareToBaseline(results, baseline, threshold):
+  """Returns a list of messages describing every measurement of |results|
+  worse than in |baseline| by more than a |threshold| fraction."""
+  regressions = []
+  for name, result in sorted(results.iteritems()):
+    if name not in baseline:
+      print 'Warning: %s is not in the baseline' % name
+      continue
+    for key, slack in COMPARED_MEASUREMENTS:
+      limit = baseline[name][key] * (1 + threshold) + slack
+      if result[key] > limit:
+        regressions.append('%s: %s is %g, baseline %g (limit %g)' % (
+            name, key, result[key], baseline[name][key], limit))
+  return regressions
+
+
+def LoadBaseline(fname):
+  with open(fname) as f:
+    baseline = json.load(f)
+  if baseline.get('version') != BASELINE_VERSION:
+    raise ValueError('%s has version %s, expected %d' % (
+        fname, baseline.get('version'), BASELINE_VERSION))
+  return baseline['results']
+
+
+def SaveBaseline(fname, results):
+  with open(fname, 'w') as f:
+    json.dump({'version': BASELINE_VERSION, 'results': results}, f, indent=2,
+              sort_keys=True)
+
+
+def Run(args):
+  results = RunCorpus(compact=args.compact, repeat=args.repeat)
+  if args.save_baseline:
+    SaveBaseline(args.save_baseline, results)
+  if args.baseline:
+    regressions = CompareToBaseline(results, LoadBaseline(args.baseline),
+                                    args.threshold)
+    for regression in regressions:
+      print 'Regression: %s' % regression
+    if regressions:
+      sys.exit(1)
+
+
+def Generate(args):
+  spec = CorpusSpec(os.path.basename(args.output), args.tracks, args.events,
+                    args.running_status, args.noise, args.tempo_changes)
+  WriteSyntheticFile(args.output, spec, seed=args.seed)
+
+
+def Memory(args):
+  for fname in args.files:
+    CompareMemory(fname)
+
+
+def PeakResidentKb():
+  """Returns the peak resident set size of this process, in kilobytes."""
+  # On Linux, ru_maxrss also covers the process this one was exec()ed from,
+  # so prefer the high water mark of this process' own memory.
+  try:
+    with open('/proc/self/status') as f:
+      for line in f:
+        if line.startswith('VmHWM:'):
+          return int(line.split()[1])
+  except IOError:
+    pass
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def PrintPeakMemory(args):
+  before = PeakResidentKb()
+  LoadQuietly(args.file, compact=args.compact)
+  print PeakResidentKb() - before
+
+
+def main():
+  parser = argparse.ArgumentParser(
+      description=__doc__.split('\n\n')[0],
+      formatter_class=argparse.RawDescriptionHelpFormatter,
+      epilog=__doc__.split('\n\n')[2])
+  commands = parser.add_subparsers()
+
+  run = commands.add_parser('run')
+  run.add_argument('--baseline', help='JSON file to compare results to')
+  run.add_argument('--save-baseline', help='JSON file to save results to')
+  run.add_argument('--threshold', type=float, default=0.25,
+                   help='allowed fraction by which results may be worse')
+  run.add_argument('--compact', action='store_true',
+                   help='load events into MidiEventColumns')
+  run.add_argument('--repeat', type=int, default=3,
+                   help='number of runs of each measurement; the best counts')
+  run.set_defaults(function=Run)
+
+  generate = commands.add_parser('generate')
+  generate.add_argument('output')
+  generate.add_argument('--tracks', type=int, default=1)
+  generate.add_argument('--events', type=int, default=10000,
+                        help='number of events per track')
+  generate.add_argument('--running-status', type=float, default=0.5)
+  generate.add_argument('--noise', type=float, default=0.02)
+  generate.add_argument('--tempo-changes', type=int, default=0)
+  generate.add_argument('--seed', type=int, default=0)
+  generate.set_defaults(function=Generate)
+
+  memory = commands.add_parser('memory')
+  memory.add_argument('files', nargs='+')
+  memory.set_defaults(function=Memory)
+
+  # Used by PeakMemory() to measure a single load in a fresh process.
+  peak_memory = commands.add_parser('peak-memory')
+  peak_memory.add_argument('file')
+  peak_memory.add_argument('--compact', action='store_true')
+  peak_memory.set_defaults(function=PrintPeakMemory)
+
+  args = parser.parse_args()
+  args.function(args)
+
+
+if __name__ == '__main__':
+  main()
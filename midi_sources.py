@@ -0,0 +1,266 @@
+"""Piano input merged from several MIDI sources.
+
+Usage:
+  python midi_sources.py play <song.mid> <destination> [--hand HAND]
+                              [--slowdown F]
+      Plays the notes of a song in real time, as raw MIDI bytes sent to a
+      fifo:PATH or unix:PATH source, e.g. to drive the application in tests.
+
+Sources are named by strings:
+  usb         The USB MIDI piano, read by piano_input.PianoInput.
+  PATH        A raw MIDI device file, such as /dev/snd/midiC1D0.
+  fifo:PATH   A named pipe (created if needed) to which raw MIDI is written.
+  unix:PATH   A unix socket (created if needed) accepting connections which
+              send raw MIDI. Several connections may be open at once.
+
+Copyright 2015 Google Inc. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import argparse
+import errno
+import glob
+import os
+import select
+import socket
+import stat
+import thread
+
+import clock
+import input_queue
+import midi
+import piano_input
+
+NOTE_OFF = 0x80
+NOTE_ON = 0x90
+SYSEX_START = 0xf0
+REAL_TIME = 0xf8  # Status bytes from here on are single byte messages.
+
+READ_SIZE = 4096
+
+
+def ListRawMidiDevices():
+  """Returns the paths of the raw MIDI device files of the system."""
+  return sorted(glob.glob('/dev/snd/midiC*D*'))
+
+
+class RawMidiParser(object):
+  """Decodes the note events of a stream of raw MIDI bytes, which may be fed
+  in arbitrary pieces.
+
+  Running status is supported: data bytes without a status byte repeat the
+  previous channel message. Real time messages may appear anywhere, even
+  within other messages, and are skipped. System exclusive messages and
+  other system messages are skipped too, and cancel running status.
+  """
+
+  def __init__(self):
+    self._status = None  # Running status, or None.
+    self._data = []  # Data bytes of the current message.
+    self._in_sysex = False
+
+  def _MessageSize(self):
+    """Returns the number of data bytes of messages with the running
+    status."""
+    if self._status & 0xf0 in (0xc0, 0xd0):
+      return 1
+    return 2
+
+  def Feed(self, data):
+    """Decodes |data| (a str). Returns the list of (note, volume) of the
+    note events completed, volume being 0 for released notes."""
+    events = []
+    for byte in bytearray(data):
+      if byte >= REAL_TIME:
+        continue
+      if byte & 0x80:
+        self._data = []
+        self._in_sysex = byte == SYSEX_START
+        # System common messages cancel running status.
+        self._status = byte if byte < SYSEX_START else None
+        continue
+      if self._in_sysex or self._status is None:
+        continue
+      self._data.append(byte)
+      if len(self._data) < self._MessageSize():
+        continue
+      command = self._status & 0xf0
+      if command in (NOTE_ON, NOTE_OFF):
+        note, volume = self._data
+        events.append((note, volume if command == NOTE_ON else 0))
+      self._data = []
+    return events
+
+
+class MidiInput(object):
+  """Reads the keys played on any number of MIDI sources, and merges them
+  into one queue, like piano_input.PianoInput does for a single device.
+
+  All sources but USB are file descriptors, watched by a single thread with
+  select(): each read is timestamped when select() returns. USB devices are
+  read by their own piano_input.PianoInput thread, putting into the same
+  queue.
+
+  Attributes:
+    user_input: input_queue.InputQueue of (note, volume, timestamp) tuples,
+        where volume is 0 for released keys, and timestamp is the clock time
+        of the capture.
+    clock: clock.MonotonicClock timestamping the input.
+    sources: Names of the sources opened.
+  """
+
+  def __init__(self, sources):
+    """Opens the named |sources| (see the module documentation). Raises
+    IOError if one of them cannot be opened."""
+    self.user_input = input_queue.InputQueue()
+    self.clock = clock.MonotonicClock()
+    self.sources = []
+    self._readers = {}  # File descriptor -> function reading it.
+    self._stop_read, self._stop_write = os.pipe()
+    for source in sources:
+      try:
+        self._Open(source)
+      except (OSError, socket.error) as e:
+        raise IOError('Cannot open MIDI source %s: %s' % (source, e))
+      self.sources.append(source)
+    thread.start_new_thread(self._ReadLoop, ())
+
+  def _Open(self, source):
+    if source == 'usb':
+      piano_input.PianoInput(self.user_input)
+    elif source.startswith('fifo:'):
+      path = source[len('fifo:'):]
+      if not os.path.exists(path):
+        os.mkfifo(path)
+      # Opened for writing too, so that the pipe does not reach its end when
+      # the last writer closes it.
+      self._AddStream(os.open(path, os.O_RDWR | os.O_NONBLOCK))
+    elif source.startswith('unix:'):
+      path = source[len('unix:'):]
+      if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+        os.remove(path)
+      listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+      listener.bind(path)
+      listener.listen(4)
+      self._readers[listener.fileno()] = lambda timestamp: self._Accept(
+          listener)
+    else:
+      self._AddStream(os.open(source, os.O_RDONLY | os.O_NONBLOCK))
+
+  def _AddStream(self, fd, sock=None):
+    """Reads raw MIDI from |fd|, which is closed at its end. |sock| is the
+    socket object owning |fd|, if any."""
+    parser = RawMidiParser()
+
+    def Read(timestamp):
+      try:
+        data = os.read(fd, READ_SIZE)
+      except OSError as e:
+        if e.errno == errno.EAGAIN:
+          return True
+        print 'MIDI source read failed (%s), closing it.' % e
+        data = ''
+      if not data:
+        if sock is not None:
+          sock.close()
+        else:
+          os.close(fd)
+        return False
+      self.user_input.PutMany([(note, volume, timestamp)
+                               for note, volume in parser.Feed(data)])
+      return True
+    self._readers[fd] = Read
+
+  def _Accept(self, listener):
+    try:
+      connection, _ = listener.accept()
+    except socket.error:
+      return True
+    self._AddStream(connection.fileno(), connection)
+    return True
+
+  def _ReadLoop(self):
+    while True:
+      try:
+        readable, _, _ = select.select(
+            list(self._readers) + [self._stop_read], [], [])
+      except select.error as e:
+        if e.args[0] == errno.EINTR:
+          continue
+        raise
+      timestamp = self.clock.Now()
+      if self._stop_read in readable:
+        return
+      for fd in readable:
+        if not self._readers[fd](timestamp):
+          del self._readers[fd]
+
+  def Close(self):
+    """Stops reading the file descriptor sources."""
+    os.write(self._stop_write, 'x')
+
+  def ClearInput(self):
+    while not self.user_input.empty():
+      self.user_input.get()
+
+
+def _OpenDestination(destination):
+  """Returns a function writing to a fifo:PATH or unix:PATH destination."""
+  if destination.startswith('fifo:'):
+    fd = os.open(destination[len('fifo:'):], os.O_WRONLY)
+    return lambda data: os.write(fd, data)
+  if destination.startswith('unix:'):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(destination[len('unix:'):])
+    return sock.sendall
+  raise ValueError('Unknown destination %s' % destination)
+
+
+def PlaySong(midi_file, write, hand='both', slowdown_factor=1.0,
+             clock_obj=None):
+  """Plays the notes of |midi_file| played by |hand|, in real time slowed
+  down by |slowdown_factor|, by passing raw MIDI bytes to |write|."""
+  clock_obj = clock_obj or clock.MonotonicClock()
+  timeline = midi_file.GetTimeline()
+  events = timeline.Select(timeline.HandParts(hand))
+  start = clock_obj.Now()
+  time = 0
+  for event in events:
+    time += event.delta
+    due = start + midi_file.tempo.TicksToSeconds(time) * slowdown_factor
+    now = clock_obj.Now()
+    if due > now:
+      clock_obj.Sleep(due - now)
+    write(chr(event.raw_cmd) + chr(event.note) + chr(event.volume))
+
+
+def main():
+  parser = argparse.ArgumentParser(
+      description=__doc__.split('\n\n')[0],
+      formatter_class=argparse.RawDescriptionHelpFormatter,
+      epilog='\n\n'.join(__doc__.split('\n\n')[1:3]))
+  commands = parser.add_subparsers()
+  play = commands.add_parser('play')
+  play.add_argument('song')
+  play.add_argument('destination')
+  play.add_argument('--hand', default='both',
+                    choices=('both', 'right', 'left'))
+  play.add_argument('--slowdown', type=float, default=1.0)
+  args = parser.parse_args()
+  PlaySong(midi.MidiFile(args.song), _OpenDestination(args.destination),
+           hand=args.hand, slowdown_factor=args.slowdown)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,290 @@
+"""Tests of the MIDI file parser of midi.py.
+
+Tracks are decoded in place, by offset into the chunk data. The events of
+midi.MidiFile are compared with those of the previous decoding loop, which
+passes the remaining data of the track, sliced, to every
+MidiEvent.ReadSkippingIgnores or MidiEvent.Read call. The files are synthetic
+format 0 and 1 files with running status, meta and controller events. Tracks
+decoded in parallel by a multiprocessing.Pool must equal those decoded in
+sequence.
+
+Usage:
+  python midi_test.py
+
+Copyright 2015 Google Inc. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import multiprocessing
+import os
+import random
+import shutil
+import struct
+import sys
+import tempfile
+import unittest
+
+import midi
+
+# Delay (in ticks) MidiTrack adds before the first event of a track.
+FIRST_EVENT_DELAY = 300
+
+
+def EncodeVarLen(value):
+  """Encodes an int as a MIDI variable-length quantity."""
+  encoded = [chr(value & 0x7f)]
+  value >>= 7
+  while value:
+    encoded.append(chr((value & 0x7f) | 0x80))
+    value >>= 7
+  return ''.join(reversed(encoded))
+
+
+def RandomTrack(rng, num_events, tempo_changes=False):
+  """Returns the data of a track chunk with |num_events| random note,
+  controller, program change and meta events. Channel events use running
+  status half of the time it is possible."""
+  events = []
+  status = None  # Running status, or None if cancelled by a meta event.
+  playing = []
+  for _ in xrange(num_events):
+    delta = EncodeVarLen(rng.choice((0, 0, 10, 120, 480, 20000)))
+    kind = rng.random()
+    if kind < 0.05:
+      if tempo_changes:
+        event = '\xff\x51\x03' + struct.pack('>i', rng.randint(
+            250000, 1000000))[1:]
+      else:
+        text = 'x' * rng.randint(0, 200)
+        event = '\xff\x01' + EncodeVarLen(len(text)) + text
+      events.append(delta + event)
+      status = None
+      continue
+    if kind < 0.1:
+      new_status = 0xb0 | rng.randrange(16)  # Controller.
+      data = chr(rng.randrange(0x80)) + chr(rng.randrange(0x80))
+    elif kind < 0.15:
+      new_status = 0xc0 | rng.randrange(16)  # Program change.
+      data = chr(rng.randrange(0x80))
+    elif playing and (len(playing) > 10 or rng.random() < 0.5):
+      channel, note = playing.pop(rng.randrange(len(playing)))
+      if rng.random() < 0.5:
+        new_status, volume = 0x80 | channel, rng.randrange(0x80)
+      else:
+        new_status, volume = 0x90 | channel, 0
+      data = chr(note) + chr(volume)
+    else:
+      channel, note = rng.randrange(4), rng.randint(21, 108)
+      playing.append((channel, note))
+      new_status = 0x90 | channel
+      data = chr(note) + chr(rng.randint(1, 127))
+    if new_status == status and rng.random() < 0.5:
+      events.append(delta + data)
+    else:
+      events.append(delta + chr(new_status) + data)
+    status = new_status
+  events.append('\x00\xff\x2f\x00')  # End of track.
+  return ''.join(events)
+
+
+def WriteMidiFile(fname, tracks, ticks_per_note=480):
+  """Writes a MIDI file with the given track chunk data. Files with several
+  tracks are format 1."""
+  with open(fname, 'wb') as f:
+    f.write('MThd' + struct.pack('>ihhh', 6, 0 if len(tracks) == 1 else 1,
+                                 len(tracks), ticks_per_note))
+    for data in tracks:
+      f.write('MTrk' + struct.pack('>i', len(data)) + data)
+
+
+def LoadQuietly(fname, **kwargs):
+  """Loads a midi file, discarding the progress messages of the parser."""
+  stdout = sys.stdout
+  sys.stdout = open(os.devnull, 'w')
+  try:
+    return midi.MidiFile(fname, **kwargs)
+  finally:
+    sys.stdout.close()
+    sys.stdout = stdout
+
+
+def _Silence():
+  """Discards the progress messages of the parser in pool workers."""
+  sys.stdout = open(os.devnull, 'w')
+
+
+def SlicingDecode(data, skip_ignores):
+  """Decodes the events of track chunk |data| as MidiTrack did before
+  decoding in place: each event is read from the remaining data, sliced."""
+  events = []
+  bytes_read = 0
+  prev_event = None
+  while bytes_read < len(data):
+    event = midi.MidiEvent()
+    if skip_ignores:
+      bytes_read += event.ReadSkippingIgnores(data[bytes_read:], prev_event)
+    else:
+      bytes_read += event.Read(data[bytes_read:], prev_event)
+    if not events:
+      event.delta += FIRST_EVENT_DELAY
+    events.append(event)
+    prev_event = event
+  return events
+
+
+def EventFields(event):
+  fields = (event.delta, event.cmd, event.raw_cmd, event.channel, event.note,
+            event.volume, event.ignore_me)
+  if event.cmd == 0xff:
+    fields += (event.type, event.data)
+  return fields
+
+
+class MidiFileTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp(prefix='midi_test')
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def CheckFile(self, tracks):
+    """Checks that the events of a file with |tracks| are those decoded by
+    SlicingDecode."""
+    fname = os.path.join(self.directory, 'song.mid')
+    WriteMidiFile(fname, tracks)
+    midi_file = LoadQuietly(fname)
+    self.assertEqual(len(tracks), len(midi_file.tracks))
+    for i, (data, track) in enumerate(zip(tracks, midi_file.tracks)):
+      # The first track of format 1 files keeps its meta events.
+      skip_ignores = not (len(tracks) > 1 and i == 0)
+      self.assertEqual(
+          [EventFields(event) for event in SlicingDecode(data, skip_ignores)],
+          [EventFields(event) for event in track.events], 'track %d' % i)
+
+  def testFormat0(self):
+    rng = random.Random(0)
+    self.CheckFile([RandomTrack(rng, 5000, tempo_changes=True)])
+
+  def testFormat1(self):
+    rng = random.Random(1)
+    self.CheckFile([RandomTrack(rng, 200, tempo_changes=True)] +
+                   [RandomTrack(rng, 2000) for _ in xrange(4)])
+
+  def testRunningStatusOnly(self):
+    data = ('\x00\x90\x3c\x40' + '\x10\x3e\x40' + '\x10\x3c\x00' +
+            '\x10\x3e\x00' + '\x00\xff\x2f\x00')
+    self.CheckFile([data])
+    midi_file = LoadQuietly(os.path.join(self.directory, 'song.mid'))
+    self.assertEqual(
+        [(FIRST_EVENT_DELAY, 0x90, 0x3c, 0x40), (0x10, 0x90, 0x3e, 0x40),
+         (0x10, 0x80, 0x3c, 0), (0x10, 0x80, 0x3e, 0)],
+        [(event.delta, event.cmd, event.note, event.volume)
+         for event in midi_file.tracks[0].events if not event.ignore_me])
+
+  def testSysex(self):
+    # A system exclusive message, and an escaped one, are both skipped using
+    # their length, which counts the terminating 0xf7.
+    data = ('\x00\xf0\x05\x7e\x7f\x09\x01\xf7' + '\x10\x90\x3c\x40' +
+            '\x20\xf7\x02\x43\xf7' + '\x08\x80\x3c\x00' + '\x00\xff\x2f\x00')
+    self.CheckFile([data, data])
+    midi_file = LoadQuietly(os.path.join(self.directory, 'song.mid'))
+    self.assertEqual([0xf0, 0x90, 0xf7, 0x80, 0xff],
+                     [event.cmd for event in midi_file.tracks[0].events])
+    self.assertEqual(
+        [(FIRST_EVENT_DELAY + 0x10, 0x90, 0x3c, 0x40), (0x28, 0x80, 0x3c, 0)],
+        [(event.delta, event.cmd, event.note, event.volume)
+         for event in midi_file.tracks[1].events if not event.ignore_me])
+
+  def WriteWithUnknownChunks(self, tracks):
+    """Writes a file with |tracks|, and a chunk of unknown type before each
+    of them. Returns its name."""
+    fname = os.path.join(self.directory, 'unknown_chunks.mid')
+    WriteMidiFile(fname, tracks)
+    with open(fname, 'rb') as f:
+      data = f.read()
+    unknown = 'XUNK' + struct.pack('>i', 4) + '\x90\x3c\x40\x00'
+    pos = 14  # After the header chunk.
+    chunks = [data[:pos]]
+    for track in tracks:
+      chunks += [unknown, data[pos:pos + 8 + len(track)]]
+      pos += 8 + len(track)
+    with open(fname, 'wb') as f:
+      f.write(''.join(chunks))
+    return fname
+
+  def testUnknownChunks(self):
+    rng = random.Random(3)
+    tracks = [RandomTrack(rng, 100, tempo_changes=True), RandomTrack(rng, 500)]
+    self.CheckFile(tracks)
+    midi_file = LoadQuietly(self.WriteWithUnknownChunks(tracks))
+    self.assertEqual(len(tracks), len(midi_file.tracks))
+    for i, (data, track) in enumerate(zip(tracks, midi_file.tracks)):
+      self.assertEqual(
+          [EventFields(event) for event in SlicingDecode(data, i > 0)],
+          [EventFields(event) for event in track.events], 'track %d' % i)
+
+  def testPool(self):
+    rng = random.Random(4)
+    tracks = [RandomTrack(rng, 200, tempo_changes=True)] + [
+        RandomTrack(rng, 1000, tempo_changes=True) for _ in xrange(3)]
+    fname = os.path.join(self.directory, 'song.mid')
+    WriteMidiFile(fname, tracks)
+    pool = multiprocessing.Pool(2, initializer=_Silence)
+    try:
+      for path in (fname, self.WriteWithUnknownChunks(tracks)):
+        for compact in (False, True):
+          sequential = LoadQuietly(path, compact=compact)
+          parallel = LoadQuietly(path, compact=compact, pool=pool)
+          self.assertEqual(sequential.tempo_map, parallel.tempo_map)
+          self.assertEqual(len(sequential.tracks), len(parallel.tracks))
+          for track, parallel_track in zip(sequential.tracks,
+                                           parallel.tracks):
+            self.assertEqual(sorted(vars(track)), sorted(vars(parallel_track)))
+            self.assertEqual(track.tempo_events, parallel_track.tempo_events)
+            self.assertEqual(
+                [EventFields(event) for event in track.events],
+                [EventFields(event) for event in parallel_track.events])
+    finally:
+      pool.close()
+      pool.join()
+
+  def testSplitsHands(self):
+    fname = os.path.join(self.directory, 'song.mid')
+    # Channels 1 and 10 (percussion): a single part is played by hands.
+    notes = ('\x00\x90\x3c\x40' + '\x00\x99\x24\x40' + '\x10\x80\x3c\x00' +
+             '\x00\x89\x24\x00')
+    WriteMidiFile(fname, [notes + '\x00\xff\x2f\x00'])
+    timeline = LoadQuietly(fname).GetTimeline()
+    self.assertFalse(timeline.SplitsHands())
+    self.assertEqual(timeline.HandParts('left'), timeline.HandParts('right'))
+    # A second, lower part on channel 2 is played by the left hand.
+    bass = '\x00\x91\x30\x40' + '\x10\x81\x30\x00'
+    WriteMidiFile(fname, [notes + bass + '\x00\xff\x2f\x00'])
+    timeline = LoadQuietly(fname).GetTimeline()
+    self.assertTrue(timeline.SplitsHands())
+    self.assertEqual(set([(0, 1)]), timeline.HandParts('left'))
+    self.assertEqual(set([(0, 0)]), timeline.HandParts('right'))
+
+  def testReadVarLen(self):
+    rng = random.Random(2)
+    for value in [0, 0x7f, 0x80, 0x3fff, 0x4000, 0x0fffffff] + [
+        rng.randrange(0x10000000) for _ in xrange(100)]:
+      encoded = EncodeVarLen(value)
+      self.assertEqual((value, len(encoded)),
+                       midi.ReadVarLen('\x00' + encoded + '\x00', 1))
+
+
+if __name__ == '__main__':
+  unittest.main()
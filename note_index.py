@@ -0,0 +1,119 @@
+"""Index of the notes of a song, for fast queries of the notes in view.
+
+Copyright 2015 Google Inc. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import bisect
+import collections
+
+# A note held from tick |start| until tick |end|.
+NoteInterval = collections.namedtuple('NoteInterval',
+                                      ['start', 'end', 'note', 'channel'])
+
+
+def NoteIntervalsFromEvents(events, first=0, start_time=0, playing=None):
+  """Pairs note-on with note-off events into a list of NoteInterval objects.
+
+  A note-on for a note that is already playing ends the previous interval.
+  Notes that are never turned off last until the last event of the track.
+
+  Args:
+    events: midi.MidiEventColumns holding the events, read from their
+        arrays.
+    first: Index of the first event paired.
+    start_time: Time (in ticks) of the last event before |first|.
+    playing: Dict mapping notes already playing before the first event to
+        their (start, channel).
+  """
+  intervals = []
+  playing = dict(playing or {})  # note -> (start, channel)
+  cur_time = start_time
+  times, cmds, ignore_me = events.time, events.cmd, events.ignore_me
+  notes, channels = events.note, events.channel
+  for i in xrange(first, len(events)):
+    cur_time = times[i]
+    if ignore_me[i]:
+      continue
+    cmd = cmds[i]
+    if cmd != 0x80 and cmd != 0x90:
+      continue
+    note = notes[i]
+    if note in playing:
+      start, channel = playing.pop(note)
+      intervals.append(NoteInterval(start, cur_time, note, channel))
+    if cmd == 0x90:
+      playing[note] = (cur_time, channels[i])
+  for note, (start, channel) in playing.iteritems():
+    intervals.append(NoteInterval(start, cur_time, note, channel))
+  return intervals
+
+
+class NoteIntervalIndex(object):
+  """Answers "which notes overlap the time window (t1, t2)" in O(log n + k).
+
+  Intervals are kept sorted by start time. Long intervals are split into
+  segments of at most |max_span| ticks, and each segment is indexed by its
+  start. Only segments starting after t1 - max_span can reach t1, so a query
+  is a bisect over the segment starts followed by a scan of the segments in
+  the window, no matter how long the notes or the song are.
+
+  Attributes:
+    intervals: List of NoteInterval objects, sorted by start time.
+    max_span: Maximal length of an indexed segment, in ticks.
+  """
+
+  def __init__(self, intervals, max_span=1000):
+    self.intervals = sorted(intervals)
+    self.max_span = max_span
+    self._starts = [interval.start for interval in self.intervals]
+    self._segment_starts = []
+    self._segment_ids = []
+    segments = []
+    for i, interval in enumerate(self.intervals):
+      # One segment per |max_span| ticks of the interval.
+      start = interval.start
+      while True:
+        segments.append((start, i))
+        start += max_span
+        if start >= interval.end:
+          break
+    segments.sort()
+    for start, i in segments:
+      self._segment_starts.append(start)
+      self._segment_ids.append(i)
+
+  @staticmethod
+  def FromEvents(events, max_span=1000):
+    return NoteIntervalIndex(NoteIntervalsFromEvents(events), max_span)
+
+  def __len__(self):
+    return len(self.intervals)
+
+  def FirstStartingAt(self, time):
+    """Returns the position in |intervals| of the first interval starting at
+    or after |time|."""
+    return bisect.bisect_left(self._starts, time)
+
+  def Query(self, t1, t2):
+    """Returns the intervals overlapping the open time window (t1, t2), that
+    is, intervals with start < t2 and end > t1, ordered by start time."""
+    lo = bisect.bisect_right(self._segment_starts, t1 - self.max_span)
+    hi = bisect.bisect_left(self._segment_starts, t2)
+    ids = set()
+    for k in xrange(lo, hi):
+      i = self._segment_ids[k]
+      if self.intervals[i].end > t1:
+        ids.add(i)
+    return [self.intervals[i] for i in sorted(ids)]
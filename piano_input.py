@@ -15,15 +15,74 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
-import Queue
 import thread
 import time
-import usb.core
-import usb.util
+try:
+  import usb.core
+  import usb.util
+except ImportError:
+  usb = None  # Packets can still be decoded, but no device can be read.
+
+import clock
+import input_queue
+
+# Code Index Numbers of USB-MIDI event packets.
+CIN_NOTE_OFF = 0x8
+CIN_NOTE_ON = 0x9
+
+USB_MIDI_PACKET_SIZE = 4
+
+
+def DecodeUsbMidiPackets(data):
+  """Decodes the note events of a USB-MIDI transfer.
+
+  |data| is a sequence of 4-byte USB-MIDI event packets. The first byte of a
+  packet holds the cable number and the Code Index Number (CIN), which gives
+  the kind of the MIDI message in the other 3 bytes. Note on and note off
+  packets are decoded on all cables and channels, and other packets (such as
+  the zero padding of a transfer) are skipped. Some devices omit the status
+  byte of note events repeating the previous status (MIDI running status):
+  as the CIN already gives the kind of message, their note and velocity are
+  then simply read one byte earlier.
+
+  Returns the list of (note, volume) of the packets, in order. Volume is 0
+  for released notes, including note on messages with velocity 0.
+  """
+  events = []
+  for i in xrange(0, len(data) - USB_MIDI_PACKET_SIZE + 1,
+                  USB_MIDI_PACKET_SIZE):
+    cin = data[i] & 0x0f
+    if cin != CIN_NOTE_ON and cin != CIN_NOTE_OFF:
+      continue
+    if data[i + 1] & 0x80:
+      note, volume = data[i + 2], data[i + 3]
+    else:
+      note, volume = data[i + 1], data[i + 2]  # Running status.
+    if cin == CIN_NOTE_OFF:
+      volume = 0
+    events.append((note, volume))
+  return events
+
 
 class PianoInput(object):
-  def __init__(self):
-    self.user_input = Queue.Queue()
+  """Reads the keys played on a USB MIDI piano.
+
+  Attributes:
+    user_input: input_queue.InputQueue of (note, volume, timestamp) tuples,
+        where volume is 0 for released keys, and timestamp is the clock time
+        of the capture.
+    clock: clock.MonotonicClock timestamping the input.
+  """
+
+  def __init__(self, user_input=None):
+    """Input is put in |user_input| if set, e.g. to merge it with that of
+    other devices."""
+    if usb is None:
+      raise IOError('Cannot read a USB MIDI device: pyusb is not installed')
+    if user_input is None:
+      user_input = input_queue.InputQueue()
+    self.user_input = user_input
+    self.clock = clock.MonotonicClock()
     endpoint_address = self._attach_device()
     thread.start_new_thread(self.GetPianoSignal, (endpoint_address, ))
 
@@ -83,11 +142,10 @@ class PianoInput(object):
       self.user_input.get()
 
   def GetPianoSignal(self, endpoint_address):
-    NOTE_ON = 0x90
-    NOTE_OFF = 0x80
     while True:
       try:
         ret = self.dev.read(endpoint_address, 32, 10000)
+        timestamp = self.clock.Now()
       except usb.core.USBError:
         # Attempt to reconnect
         endpoint_address = None
@@ -98,11 +156,10 @@ class PianoInput(object):
           except Exception as ex:
             print('Connection failed (%s), waiting 1 second...' % ex)
             time.sleep(1.0)
-      midiCmd = ret[1]
-      if (midiCmd == NOTE_ON or midiCmd == NOTE_OFF):
-          note = ret[2]
-          volume = ret[3]
-          if midiCmd == NOTE_OFF:
-            volume = 0
-          print note, (midiCmd, self.GetNote(note).lower(), volume)
-          self.user_input.put((note, volume))
+        continue
+      # A chord arrives as several packets in the same transfer.
+      events = DecodeUsbMidiPackets(ret)
+      for note, volume in events:
+        print note, (self.GetNote(note).lower(), volume)
+      self.user_input.PutMany([(note, volume, timestamp)
+                               for note, volume in events])
@@ -16,13 +16,16 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
-import Queue
 import thread
 import time
 
+import clock
+import input_queue
+
 class PianoInput(object):
   def __init__(self):
-    self.user_input = Queue.Queue()
+    self.user_input = input_queue.InputQueue()
+    self.clock = clock.MonotonicClock()
     thread.start_new_thread(self.GetPianoSignal, ())
 
   def ClearInput(self):
@@ -32,11 +35,12 @@ class PianoInput(object):
   def GetPianoSignal(self):
     while True:
       try:
-        print "Important notes: '-'=36 '+'=40  '<'=48 'Play'=50 '>'=52"
+        print ("Important notes: '-'=36 '+'=40  '<'=48 'Play'=50 '>'=52 "
+               "'Hands'=60")
         note = int(raw_input("<note> (e.g. '37'): "))
-        self.user_input.put((note, 50))
+        self.user_input.put((note, 50, self.clock.Now()))
         time.sleep(1)
-        self.user_input.put((note, 0))
+        self.user_input.put((note, 0, self.clock.Now()))
       except:
         print "Bad input"
 
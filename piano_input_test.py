@@ -0,0 +1,99 @@
+"""Tests of the decoding of USB-MIDI transfers by piano_input.py.
+
+Transfers are synthetic packet buffers, so neither a piano nor pyusb is
+needed.
+
+Usage:
+  python piano_input_test.py
+
+Copyright 2015 Google Inc. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import array
+import unittest
+
+import piano_input
+
+
+def Packet(cable, cin, *midi_bytes):
+  """Returns a USB-MIDI event packet, padded to 4 bytes."""
+  packet = [(cable << 4) | cin] + list(midi_bytes)
+  return packet + [0] * (piano_input.USB_MIDI_PACKET_SIZE - len(packet))
+
+
+def Transfer(*packets):
+  """Returns the buffer of a transfer holding |packets|, as read by pyusb."""
+  return array.array('B', sum(packets, []))
+
+
+class DecodeUsbMidiPacketsTest(unittest.TestCase):
+
+  def testChordWithPadding(self):
+    # A chord arrives in one transfer, followed by the zero padding of the
+    # unused part of the buffer.
+    data = Transfer(Packet(0, 0x9, 0x90, 60, 100),
+                    Packet(0, 0x9, 0x90, 64, 90),
+                    Packet(0, 0x9, 0x90, 67, 80),
+                    [0] * 4, [0] * 4, [0] * 4)
+    self.assertEqual([(60, 100), (64, 90), (67, 80)],
+                     piano_input.DecodeUsbMidiPackets(data))
+
+  def testNoteOff(self):
+    data = Transfer(Packet(0, 0x8, 0x80, 60, 64),
+                    Packet(0, 0x9, 0x90, 62, 0))
+    self.assertEqual([(60, 0), (62, 0)],
+                     piano_input.DecodeUsbMidiPackets(data))
+
+  def testAllCablesAndChannels(self):
+    data = Transfer(Packet(1, 0x9, 0x93, 60, 100),
+                    Packet(15, 0x9, 0x9f, 61, 101),
+                    Packet(3, 0x8, 0x85, 60, 0))
+    self.assertEqual([(60, 100), (61, 101), (60, 0)],
+                     piano_input.DecodeUsbMidiPackets(data))
+
+  def testRunningStatus(self):
+    # The status byte of the second and third notes is omitted.
+    data = Transfer(Packet(0, 0x9, 0x90, 60, 100),
+                    Packet(0, 0x9, 64, 90),
+                    Packet(0, 0x9, 60, 0),
+                    Packet(0, 0x8, 64, 30))
+    self.assertEqual([(60, 100), (64, 90), (60, 0), (64, 0)],
+                     piano_input.DecodeUsbMidiPackets(data))
+
+  def testSkipsOtherMessages(self):
+    data = Transfer(Packet(0, 0xb, 0xb0, 64, 127),  # Sustain pedal.
+                    Packet(0, 0xc, 0xc0, 5),  # Program change.
+                    Packet(0, 0xf, 0xfe),  # Active sensing.
+                    Packet(0, 0x4, 0xf0, 0x7e, 0x7f),  # Sysex start.
+                    Packet(0, 0x9, 0x90, 60, 100),
+                    Packet(0, 0xe, 0xe0, 0, 64))  # Pitch bend.
+    self.assertEqual([(60, 100)], piano_input.DecodeUsbMidiPackets(data))
+
+  def testTruncatedPacket(self):
+    data = Transfer(Packet(0, 0x9, 0x90, 60, 100),
+                    Packet(0, 0x9, 0x90, 62, 100))[:-1]
+    self.assertEqual([(60, 100)], piano_input.DecodeUsbMidiPackets(data))
+    self.assertEqual([], piano_input.DecodeUsbMidiPackets(data[:3]))
+
+  def testEmptyTransfer(self):
+    self.assertEqual([], piano_input.DecodeUsbMidiPackets(Transfer()))
+
+  def testBytearray(self):
+    data = bytearray(Transfer(Packet(0, 0x9, 0x90, 60, 100)))
+    self.assertEqual([(60, 100)], piano_input.DecodeUsbMidiPackets(data))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -14,46 +14,137 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import atexit
+import multiprocessing
 import os
 import pickle
 import sys
 import time
 
+import frame_profiler
+import input_recorder
+import key_geometry
 import keyboard
 import midi
+import midi_sources
 import piano_output
 import piano_input
 import piano_input_mock
+import song_cache
+import song_library
+import song_prefetch
 import waterfall
 
 
-def GetMidiFiles(path="./"):
-  return sorted(
-          filter(lambda filename: filename.endswith('.mid'),
-                 os.listdir('./')),
-          key=lambda f: f.lower())
+HANDS = ('both', 'right', 'left')
+
+# Songs larger than this (in bytes) are decoded while they play, instead of
+# being parsed up front.
+LAZY_LOAD_BYTES = 1 << 20
+
+# Frame rate of the waterfall. Frames which cannot be drawn in time are
+# dropped, so slow machines play at a lower rate.
+FRAMES_PER_SEC = 60
+
+# Whether to time the phases of the waterfall frames, show the timings on
+# screen, and report them when a song ends (to stdout, and as CSV to
+# PROFILE_CSV_PATH, if set).
+PROFILE_FRAMES = False
+PROFILE_CSV_PATH = 'frame_profile.csv'
+
+# Calibration profile of the keyboard and projector, written by key_geometry.
+# Without it, a 61 key keyboard filling the screen is assumed.
+CALIBRATION_PROFILE_PATH = 'calibration.json'
+
+# Sources of the piano input, merged by midi_sources.MidiInput, e.g.
+# ['usb', 'unix:/tmp/piano.sock']. If empty, the USB piano is used, or else
+# the raw MIDI devices of the system, if any.
+MIDI_SOURCES = []
+
+# Directory where the input of every play is recorded (see input_recorder),
+# or None not to record.
+RECORDINGS_DIR = None
 
 
 class Menu(object):
   def __init__(self):
     self.slowdown = 1.0
-    self.songs = GetMidiFiles()
+    self.hand = HANDS[0]
+    self.library = song_library.SongLibrary()
+    self.library.Update()
+    self.songs = self.library.GetSongs()
     self.current_song = 0
-    self.piano_display = piano_output.PianoOutput()
+    # Created before any thread is started, so the workers are forked from a
+    # single threaded process.
+    self.parse_pool = multiprocessing.Pool()
+    self.song_cache = song_cache.SongCache(pool=self.parse_pool)
+    self.prefetcher = song_prefetch.SongPrefetcher(self.LoadWaterfall)
+    self.piano_display = piano_output.PianoOutput(self.LoadCalibration())
+    if PROFILE_FRAMES:
+      self.profiler = frame_profiler.FrameProfiler(
+          show_overlay=True, csv_path=PROFILE_CSV_PATH)
+    else:
+      self.profiler = frame_profiler.NULL_PROFILER
+    atexit.register(self.piano_display.input_latency.Print)
+    self.piano_input_obj = self.OpenInput()
+    self.recorder = None  # Recorder of the current playthrough, if any.
+
+    self.CreateWaterfall()
+    self.LoadHighScores()
+
+  def OpenInput(self):
+    if MIDI_SOURCES:
+      return midi_sources.MidiInput(MIDI_SOURCES)
     try:
-      self.piano_input_obj = piano_input.PianoInput()
+      return piano_input.PianoInput()
     except IOError:
-      print "Using mock input instead of usb one."
-      print "To install pyusb run:"
-      print "    sudo apt-get install python libusb-1.0-0"
-      print "    sudo pip install pyusb --pre"
-      self.piano_input_obj = piano_input_mock.PianoInput()
+      pass
+    devices = midi_sources.ListRawMidiDevices()
+    if devices:
+      print "Using raw MIDI devices %s." % ', '.join(devices)
+      return midi_sources.MidiInput(devices)
+    print "Using mock input instead of usb one."
+    print "To install pyusb run:"
+    print "    sudo apt-get install python libusb-1.0-0"
+    print "    sudo pip install pyusb --pre"
+    return piano_input_mock.PianoInput()
 
+  def StartRecording(self):
+    """Starts recording the input of a playthrough of the current song,
+    unless one is being recorded already, or plays are not recorded. A
+    playthrough lasts from the start of the song until its end, a restart,
+    or a change of song or hand, so the plays resumed from the menu go to
+    the same recording."""
+    if self.recorder or not RECORDINGS_DIR:
+      return
+    if not os.path.isdir(RECORDINGS_DIR):
+      os.makedirs(RECORDINGS_DIR)
+    song = self.songs[self.current_song]
+    fname = os.path.join(RECORDINGS_DIR, '%s-%s.lmpi' % (
+        song[:-4], time.strftime('%Y%m%d-%H%M%S')))
+    print 'Recording input to %s' % fname
+    self.recorder = input_recorder.InputRecorder(
+        fname, os.path.abspath(os.path.join(self.library.path, song)),
+        self.waterfall.hand)
 
-    midi_file = midi.MidiFile(self.songs[self.current_song])
-    self.waterfall = waterfall.Waterfall(self.piano_input_obj,
-                                         self.piano_display, midi_file)
-    self.LoadHighScores()
+  def StopRecording(self):
+    """Ends the recording of the current playthrough, if any."""
+    if self.recorder:
+      self.recorder.Close()
+      self.recorder = None
+
+  def LoadCalibration(self):
+    try:
+      profile = key_geometry.LoadProfile(CALIBRATION_PROFILE_PATH)
+    except IOError:
+      return None
+    except ValueError as ex:
+      print 'Warning: Ignoring invalid calibration profile %s (%s)' % (
+          CALIBRATION_PROFILE_PATH, ex)
+      return None
+    print 'Using calibration profile %s (%s).' % (CALIBRATION_PROFILE_PATH,
+                                                 profile.name)
+    return profile
 
   def LoadHighScores(self):
     try:
@@ -102,10 +193,28 @@ class Menu(object):
     self.high_scores[current_song_name] = (self.score, your_name)
     self.SaveHighScores()
 
+  def LoadWaterfall(self, key):
+    """Creates the waterfall for a (song file name, hand) key."""
+    song, hand = key
+    path = os.path.join(self.library.path, song)
+    if self.library.songs[song].size > LAZY_LOAD_BYTES:
+      midi_file = midi.MidiFile(path, lazy=True)
+    else:
+      midi_file = self.song_cache.Load(path)
+    return waterfall.Waterfall(self.piano_input_obj, self.piano_display,
+                               midi_file, hand=hand,
+                               frames_per_sec=FRAMES_PER_SEC,
+                               profiler=self.profiler, name=song)
+
   def CreateWaterfall(self):
-    midi_file = midi.MidiFile(self.songs[self.current_song])
-    self.waterfall = waterfall.Waterfall(self.piano_input_obj,
-                                         self.piano_display, midi_file)
+    self.StopRecording()
+    self.waterfall = self.prefetcher.Get(
+        (self.songs[self.current_song], self.hand))
+    self.waterfall.Restart()
+    # Load the songs the user is likely to select next in the background.
+    neighbours = [self.songs[(self.current_song + step) % len(self.songs)]
+                  for step in (1, -1, 2, -2)]
+    self.prefetcher.Prefetch([(song, self.hand) for song in neighbours])
 
   def MainLoop(self):
     self.piano_input_obj.ClearInput()
@@ -126,17 +235,33 @@ class Menu(object):
       self.piano_display.SetKeyText(38 + 12,
                                     self.piano_display.KEYBOARD_HEIGHT + 50,
                                     "Select Song")
+      song = self.songs[self.current_song]
+      duration = int(self.library.songs[song].duration)
       self.piano_display.SetKeyText(38 + 12,
                                     self.piano_display.KEYBOARD_HEIGHT + 25,
-                                    self.songs[self.current_song][:-4])
+                                    '%s (%d:%02d)' % (song[:-4], duration / 60,
+                                                      duration % 60))
 
       self.piano_display.SetKeyText(38 + 12, 20, u"\u266a")
 
+      if self.waterfall.splits_hands:
+        self.piano_display.SetKeyText(38 + 24, 20, u"\u270b")
+        hand_text = self.hand
+      else:
+        hand_text = 'both (no split)'
+      self.piano_display.SetKeyText(38 + 24,
+                                    self.piano_display.KEYBOARD_HEIGHT + 50,
+                                    "Hands")
+      self.piano_display.SetKeyText(38 + 24,
+                                    self.piano_display.KEYBOARD_HEIGHT + 25,
+                                    hand_text)
+
       self.piano_display.Refresh()
-      if self.piano_input_obj.user_input.empty():
-        time.sleep(0.1)  # Avoid hogging the CPU when idle.
+      # The menu only changes on input: sleep until there is some.
+      self.piano_display.WaitForInput(self.piano_input_obj.user_input)
       while not self.piano_input_obj.user_input.empty():
         user_cmd = self.piano_input_obj.user_input.get()
+        self.piano_display.input_latency.Processed(user_cmd[2])
         if user_cmd[1] > 0:
           if user_cmd[0] == 36:
             self.slowdown = max(0.1, self.slowdown - 0.1)
@@ -150,14 +275,21 @@ class Menu(object):
             self.score = None
             self.current_song = (self.current_song + len(self.songs) - 1) % (
                 len(self.songs))
-            midi_file = midi.MidiFile(self.songs[self.current_song])
-            self.waterfall = waterfall.Waterfall(self.piano_input_obj,
-                                                 self.piano_display, midi_file)
+            self.CreateWaterfall()
+          if user_cmd[0] == 38 + 24 and self.waterfall.splits_hands:
+            self.score = None
+            self.hand = HANDS[(HANDS.index(self.hand) + 1) % len(HANDS)]
+            self.CreateWaterfall()
           if user_cmd[0] == 38 + 12:
             if self.waterfall.EndOfSong():
-              # Reload midi file, because it was destroyed during playback
-              self.CreateWaterfall()
+              self.StopRecording()
+              self.waterfall.Restart()
+            self.StartRecording()
+            self.waterfall.input_recorder = self.recorder
             self.score = self.waterfall.Continue(self.slowdown)
+            self.waterfall.input_recorder = None
+            if self.waterfall.EndOfSong():
+              self.StopRecording()
             self.ShowHighScore()
             self.CheckHighScore()
 
@@ -14,76 +14,77 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
-import Tkinter as tk
-
-OCTAVE_WIDTH = 158.0
-WHITE_NOTE_WIDTH = OCTAVE_WIDTH / 7.0
-BLACK_NOTE_WIDTH = WHITE_NOTE_WIDTH / 2.0
-BLACK_NOTE_WIDE_WIDTH = WHITE_NOTE_WIDTH / 1.0
-NOTE_IND_TO_PARAMS = {0: (0.0, WHITE_NOTE_WIDTH),
-                      1: (12.2, BLACK_NOTE_WIDTH),
-                      2: (21.8, WHITE_NOTE_WIDTH),
-                      3: (40.5, BLACK_NOTE_WIDTH),
-                      4: (44.3, WHITE_NOTE_WIDTH),
-                      5: (66.9, WHITE_NOTE_WIDTH),
-                      6: (80.2, BLACK_NOTE_WIDTH),
-                      7: (90.2, WHITE_NOTE_WIDTH),
-                      8: (106.5, BLACK_NOTE_WIDTH),
-                      9: (112.4, WHITE_NOTE_WIDTH),
-                      10: (132.9, BLACK_NOTE_WIDTH),
-                      11: (135.5, WHITE_NOTE_WIDTH)}
-NOTE_IND_TO_PARAMS_WIDE = {0: (0.0, WHITE_NOTE_WIDTH),
-                           1: (12.2-4, BLACK_NOTE_WIDE_WIDTH),
-                           2: (21.8, WHITE_NOTE_WIDTH),
-                           3: (40.5-4, BLACK_NOTE_WIDE_WIDTH),
-                           4: (44.3, WHITE_NOTE_WIDTH),
-                           5: (66.9, WHITE_NOTE_WIDTH),
-                           6: (80.2-4, BLACK_NOTE_WIDE_WIDTH),
-                           7: (90.2, WHITE_NOTE_WIDTH),
-                           8: (106.5-4, BLACK_NOTE_WIDE_WIDTH),
-                           9: (112.4, WHITE_NOTE_WIDTH),
-                           10: (132.9-4, BLACK_NOTE_WIDE_WIDTH),
-                           11: (135.5, WHITE_NOTE_WIDTH)}
-
-
-def noteToPhysicalInterval(note, wide):
-  if wide:
-    interval = NOTE_IND_TO_PARAMS_WIDE[int(note) % 12]
-  else:
-    interval = NOTE_IND_TO_PARAMS[int(note) % 12]
-  start = (int(note) / 12) * OCTAVE_WIDTH + interval[0]
-  return (start, start + interval[1])
-
-
-def noteToScreenInterval(note, waterfall, wide):
-  MIN_X = noteToPhysicalInterval(waterfall.LOWEST_NOTE, wide)[0]
-  MAX_X = noteToPhysicalInterval(waterfall.HIGHEST_NOTE, wide)[1]
-  SCALE_X = float(waterfall.CANVAS_WIDTH) / (MAX_X - MIN_X)
-  interval = noteToPhysicalInterval(note, wide)
-  return ((interval[0] - MIN_X)*SCALE_X, (interval[1] - MIN_X)*SCALE_X)
+import heapq
+try:
+  import Tkinter as tk
+except ImportError:
+  tk = None  # Only piano_output_headless can be used.
+
+import key_geometry
+import latency
 
 
 class PianoOutput(object):
-  LOWEST_NOTE = 36
-  HIGHEST_NOTE = 96
-  WHITE_NOTES = (0,2,4,5,7,9,11)
+  """Draws the keyboard and the waterfall on a fullscreen canvas.
+
+  Attributes:
+    LOWEST_NOTE, HIGHEST_NOTE: Range of the keys of the keyboard.
+    geometry: key_geometry.KeyGeometry placing the keys on the canvas.
+  """
+
+  WHITE_NOTES = key_geometry.WHITE_NOTES
 
-  def __init__(self):
+  def __init__(self, profile=None):
+    """|profile| is the key_geometry.CalibrationProfile of the keyboard,
+    by default that of a 61 key keyboard."""
     self.tk_root = tk.Tk()
     self.tk_root.attributes("-fullscreen", True)
-    self.CANVAS_WIDTH = self.tk_root.winfo_screenwidth()
-    self.CANVAS_HEIGHT = self.tk_root.winfo_screenheight()
-    self.KEYBOARD_HEIGHT = int(self.CANVAS_HEIGHT * 0.22)
-    self.CANVAS_HEIGHT = self.KEYBOARD_HEIGHT + 300
+    self._SetScreenSize(self.tk_root.winfo_screenwidth(),
+                        self.tk_root.winfo_screenheight(), profile)
+
+    canvas = tk.Canvas(self.tk_root,
+                       width=self.CANVAS_WIDTH,
+                       height=self.CANVAS_HEIGHT)
 
-    self.canvas = tk.Canvas(self.tk_root,
-                            width=self.CANVAS_WIDTH,
-                            height=self.CANVAS_HEIGHT)
+    canvas.pack()
+    self._AttachCanvas(canvas)
 
-    self.canvas.pack()
+  def _SetScreenSize(self, width, height, profile=None):
+    self.CANVAS_WIDTH = width
+    self.KEYBOARD_HEIGHT = int(height * 0.22)
+    self.CANVAS_HEIGHT = self.KEYBOARD_HEIGHT + 300
+    self.geometry = key_geometry.KeyGeometry(
+        self.CANVAS_WIDTH, self.CANVAS_HEIGHT, self.KEYBOARD_HEIGHT, profile)
+    self.LOWEST_NOTE = self.geometry.profile.lowest_note
+    self.HIGHEST_NOTE = self.geometry.profile.highest_note
+
+  def _AttachCanvas(self, canvas):
+    """Draws on |canvas|, a Tkinter.Canvas or an object with the same
+    interface, such as piano_output_headless.TraceCanvas."""
+    self.canvas = canvas
+    # Input is on screen once the canvas is refreshed after processing it.
+    self.input_latency = latency.InputLatency()
+    self._ResetFrameItems()
 
   def Clear(self):
     self.canvas.delete('all')
+    self._ResetFrameItems()
+
+  def _ResetFrameItems(self):
+    """Forgets the items kept between frames (see BeginFrame)."""
+    self._top_key = None  # Topmost key item, or None if not drawn.
+    self._highlights = {}  # Note -> key highlight item.
+    self._shown_highlights = {}  # Note -> color, as of the previous frame.
+    self._frame_highlights = {}  # Note -> color, for the current frame.
+    self._bars = []  # Pool of note bar items.
+    self._bar_states = []  # (coords, color) of each bar item.
+    self._num_shown_bars = 0  # Bars used by the previous frame.
+    self._num_frame_bars = 0  # Bars used by the current frame.
+    self._title = None  # (rect, text) items.
+    self._title_text = None
+    self._overlay = None  # Text item.
+    self._overlay_text = None
+    self.note_layer = None
 
   def DrawPiano(self, draw_guides):
     for i in xrange(self.LOWEST_NOTE, self.HIGHEST_NOTE+1):
@@ -93,6 +94,21 @@ class PianoOutput(object):
       if i % 12 not in self.WHITE_NOTES:
         self.SetKeyColor(i, color='black')
 
+  def _ScreenY(self, y):
+    """Converts a height above the bottom of the screen, as in DrawRect, to a
+    canvas coordinate."""
+    # 0 => self.CANVAS_HEIGHT
+    # CANVAS_HEIGHT - KEYBOARD_HEIGHT => CANVAS_HEIGHT - KEYBOARD_HEIGHT
+    a = float(self.KEYBOARD_HEIGHT) / (self.KEYBOARD_HEIGHT - self.CANVAS_HEIGHT)
+    b = self.CANVAS_HEIGHT
+    return a*y + b
+
+  def _NoteBarCoords(self, note, y1, y2):
+    """Returns the canvas coordinates of a rect for the specified note.
+    See DrawRect for the meaning of y1 and y2."""
+    x1, x2 = self.geometry.bars[note]
+    return (x1, self._ScreenY(y1), x2, self._ScreenY(y2))
+
   def DrawRect(self, note, y1, y2, color=None):
     """Draws a rect for the specified note.
     Args:
@@ -100,51 +116,211 @@ class PianoOutput(object):
           max val self.CANVAS_HEIGHT - self.KEYBOARD_HEIGHT
       y2: same as y1 for the end of the rect; y2 > y1
     """
-    interval = noteToScreenInterval(note, self, wide=True)
-    x1 = interval[0]
-    x2 = interval[1]
-    # 0 => self.CANVAS_HEIGHT
-    # CANVAS_HEIGHT - KEYBOARD_HEIGHT => CANVAS_HEIGHT - KEYBOARD_HEIGHT
-    a = float(self.KEYBOARD_HEIGHT) / (self.KEYBOARD_HEIGHT - self.CANVAS_HEIGHT)
-    b = self.CANVAS_HEIGHT
-    ty1 = a*y1 + b
-    ty2 = a*y2 + b
-
     if y2 > y1:
-      self.canvas.create_rectangle(
-          x1,
-          ty1,
-          x2,
-          ty2,
-          fill=color)
+      self.canvas.create_rectangle(*self._NoteBarCoords(note, y1, y2),
+                                   fill=color)
 
-  def SetKeyColor(self, note, color=None, wide=False):
-    #fillcolor = ('red' if note in self.active_notes else color) if color else 'green' if note in self.active_notes else 'yellow'
-    interval = noteToScreenInterval(note, self, wide)
-    x1 = interval[0]
-    x2 = interval[1]
+  def _KeyCoords(self, note, wide=False):
+    if wide:
+      x1, x2 = self.geometry.wide_keys[note]
+    else:
+      x1, x2 = self.geometry.keys[note]
     if note%12 in self.WHITE_NOTES:
       bottom = self.CANVAS_HEIGHT
     else:
-      bottom = self.CANVAS_HEIGHT - 50
-    self.canvas.create_rectangle(x1,
-                                 bottom,
-                                 x2,
-                                 self.CANVAS_HEIGHT - (self.KEYBOARD_HEIGHT),
-                                 fill=color)
+      bottom = self.CANVAS_HEIGHT - key_geometry.BLACK_KEY_GAP
+    return (x1, bottom, x2, self.CANVAS_HEIGHT - (self.KEYBOARD_HEIGHT))
+
+  def SetKeyColor(self, note, color=None, wide=False):
+    return self.canvas.create_rectangle(*self._KeyCoords(note, wide),
+                                        fill=color)
 
   def SetTitle(self, text):
-    self.canvas.create_rectangle(0,0,240,40,fill='white')
-    self.canvas.create_text(120,20,font=(None, 16),
-                            text=text)
+    """Shows |text| in the top left corner. The title is kept between calls,
+    and only updated when its text changes."""
+    if self._title is None:
+      self._title = (self.canvas.create_rectangle(0,0,240,40,fill='white'),
+                     self.canvas.create_text(120,20,font=(None, 16), text=''))
+    if text != self._title_text:
+      self.canvas.itemconfig(self._title[1], text=text)
+      self._title_text = text
+
+  def SetOverlay(self, text):
+    """Shows |text| in small print in the top right corner, above the note
+    bars. Like the title, the overlay is kept between calls."""
+    if self._overlay is None:
+      self._overlay = self.canvas.create_text(
+          self.CANVAS_WIDTH - 10, 10, anchor='ne', font=(None, 10), text='')
+    if text != self._overlay_text:
+      self.canvas.itemconfig(self._overlay, text=text)
+      self._overlay_text = text
+
   def Refresh(self):
     self.canvas.update()
+    self.input_latency.Displayed()
+
+  def WaitForInput(self, user_input, timeout=None):
+    """Runs the Tk event loop until |user_input| (an input_queue.InputQueue)
+    is not empty, or for at most |timeout| seconds if set. Uses no CPU while
+    waiting. Returns whether there is input."""
+    user_input.ClearWakeup()
+    if not user_input.empty():
+      return True
+    woken = tk.IntVar(self.tk_root, 0)
+    def Wake(*unused_args):
+      woken.set(1)
+    self.tk_root.tk.createfilehandler(user_input.fileno(), tk.READABLE, Wake)
+    timer = None
+    if timeout is not None:
+      timer = self.tk_root.after(int(timeout * 1000), Wake)
+    try:
+      self.tk_root.wait_variable(woken)
+    finally:
+      self.tk_root.tk.deletefilehandler(user_input.fileno())
+      if timer is not None:
+        self.tk_root.after_cancel(timer)
+    return not user_input.empty()
+
+  def BeginFrame(self):
+    """Starts drawing a frame of the waterfall.
+
+    Frames are drawn in retained mode: the keys and the title are created by
+    the first frame and kept, and note bars and key highlights reuse the
+    canvas items of the previous frame, so that only items which changed are
+    updated. Within a frame, only HighlightKey, DrawNoteBar and SetTitle may
+    be called, and SetOverlay. EndFrame shows the frame. Clear() deletes all
+    the items.
+    """
+    if self._top_key is None:
+      self.Clear()
+      self.DrawPiano(True)
+      self._top_key = self.canvas.find_all()[-1]
+      self.SetTitle('')
+    self._frame_highlights = {}
+    self._num_frame_bars = 0
+
+  def HighlightKey(self, note, color):
+    """Colors a (wide) key for the current frame only."""
+    self._frame_highlights[note] = color
+
+  def DrawNoteBar(self, note, y1, y2, color):
+    """Draws a rect for the specified note, for the current frame only.
+    See DrawRect for the meaning of the arguments."""
+    if y2 <= y1:
+      return
+    coords = self._NoteBarCoords(note, y1, y2)
+    i = self._num_frame_bars
+    self._num_frame_bars += 1
+    if i == len(self._bars):
+      bar = self.canvas.create_rectangle(*coords, fill=color)
+      self.canvas.tag_lower(bar, self._title[0])
+      self._bars.append(bar)
+      self._bar_states.append((coords, color))
+      return
+    bar = self._bars[i]
+    prev_coords, prev_color = self._bar_states[i]
+    if coords != prev_coords:
+      self.canvas.coords(bar, *coords)
+    if color != prev_color:
+      self.canvas.itemconfig(bar, fill=color)
+    if i >= self._num_shown_bars:
+      self.canvas.itemconfig(bar, state='normal')
+    self._bar_states[i] = (coords, color)
+
+  def EndFrame(self, refresh=True):
+    """Hides what the previous frame drew and the current one did not, and
+    shows the frame, unless |refresh| is False: then the caller must call
+    Refresh() to show it."""
+    for bar in self._bars[self._num_frame_bars:self._num_shown_bars]:
+      self.canvas.itemconfig(bar, state='hidden')
+    self._num_shown_bars = self._num_frame_bars
+    for note in self._shown_highlights:
+      if note not in self._frame_highlights:
+        self.canvas.itemconfig(self._highlights[note], state='hidden')
+    for note, color in self._frame_highlights.iteritems():
+      if note not in self._highlights:
+        self._highlights[note] = self.SetKeyColor(note, color=color, wide=True)
+        # Above the keys, below the note bars.
+        self.canvas.tag_raise(self._highlights[note], self._top_key)
+      elif self._shown_highlights.get(note) != color:
+        self.canvas.itemconfig(self._highlights[note], fill=color,
+                               state='normal')
+    self._shown_highlights = self._frame_highlights
+    if refresh:
+      self.Refresh()
+
+  def CreateNoteLayer(self, pixels_per_tick, time):
+    """Replaces the note layer by an empty NoteLayer scrolled to |time|.
+    Must be called within a frame."""
+    if self.note_layer is not None:
+      self.note_layer.Delete()
+    self.note_layer = NoteLayer(self, pixels_per_tick, time)
+    return self.note_layer
 
   def SetKeyText(self, note, y, text=""):
-    interval = noteToScreenInterval(note, self, False)
-    x1 = interval[0]
-    x2 = interval[1]
+    x1, x2 = self.geometry.keys[note]
     return self.canvas.create_text((x1+x2)/2,
                                    self.CANVAS_HEIGHT - y,font=(None, 16),
                                    text=text)
 
+
+
+class NoteLayer(object):
+  """Note bars of the waterfall, placed on the canvas in song time.
+
+  All bars share the NoteLayer.TAG canvas tag, so scrolling is a single
+  canvas.move, no matter how many bars are shown. Bars are only added when
+  they come into view and deleted once played. The part of the bars above
+  the keyboard is hidden by a mask of the background color.
+
+  Attributes:
+    time: Song time (in ticks) at the bottom of the screen.
+    pixels_per_tick: Height of a tick, as in the y arguments of DrawRect.
+  """
+
+  TAG = 'notes'
+
+  def __init__(self, piano_output, pixels_per_tick, time):
+    self.piano_output = piano_output
+    self.canvas = piano_output.canvas
+    self.pixels_per_tick = pixels_per_tick
+    self.time = time
+    self._mask = self.canvas.create_rectangle(
+        0, 0, piano_output.CANVAS_WIDTH,
+        piano_output.CANVAS_HEIGHT - piano_output.KEYBOARD_HEIGHT,
+        fill=self.canvas.cget('background'), outline='')
+    self.canvas.tag_lower(self._mask, piano_output._title[0])
+    self._note_bars = {}  # Note -> set of bar items.
+    self._bar_ends = []  # Heap of (end time, bar item, note).
+
+  def AddNote(self, note, start, end, color):
+    """Adds a bar for a note played from tick |start| to tick |end|."""
+    y1 = (start - self.time) * self.pixels_per_tick
+    y2 = (end - self.time) * self.pixels_per_tick
+    bar = self.canvas.create_rectangle(
+        *self.piano_output._NoteBarCoords(note, y1, y2), fill=color,
+        tags=self.TAG)
+    self.canvas.tag_lower(bar, self._mask)
+    self._note_bars.setdefault(note, set()).add(bar)
+    heapq.heappush(self._bar_ends, (end, bar, note))
+
+  def SetNoteColor(self, note, color):
+    """Changes the color of all bars of |note|."""
+    for bar in self._note_bars.get(note, ()):
+      self.canvas.itemconfig(bar, fill=color)
+
+  def ScrollTo(self, time):
+    """Scrolls forward to |time|, and deletes the bars of notes that ended."""
+    self.canvas.move(self.TAG, 0, self.piano_output._ScreenY(0) -
+                     self.piano_output._ScreenY(
+                         (time - self.time) * self.pixels_per_tick))
+    self.time = time
+    while self._bar_ends and self._bar_ends[0][0] <= time:
+      _, bar, note = heapq.heappop(self._bar_ends)
+      self._note_bars[note].discard(bar)
+      self.canvas.delete(bar)
+
+  def Delete(self):
+    """Deletes all the items of the layer."""
+    self.canvas.delete(self.TAG)
+    self.canvas.delete(self._mask)
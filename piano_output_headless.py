@@ -0,0 +1,277 @@
+"""PianoOutput backend which needs no display, for tests and benchmarks.
+
+A TraceCanvas stands in for the Tkinter canvas: it keeps the canvas items in
+memory, records every draw call into a compact trace, and can rasterize the
+items into an in-memory pixel buffer on each refresh.
+
+Copyright 2015 Google Inc. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import cPickle as pickle
+import timeit
+import zlib
+
+import piano_output
+
+# Bump whenever the format of saved traces changes.
+TRACE_VERSION = 1
+
+# Operation codes of trace entries. Each entry is a tuple starting with one
+# of these, followed by the arguments of the call.
+OP_CREATE_RECTANGLE = 0  # (op, item, coords, options)
+OP_CREATE_TEXT = 1  # (op, item, coords, options)
+OP_DELETE = 2  # (op, tag_or_item)
+OP_COORDS = 3  # (op, item, coords)
+OP_ITEMCONFIG = 4  # (op, item, options)
+OP_MOVE = 5  # (op, tag_or_item, dx, dy)
+OP_TAG_LOWER = 6  # (op, item, below_item)
+OP_TAG_RAISE = 7  # (op, item, above_item)
+OP_INSERT = 8  # (op, item, index, text)
+OP_DCHARS = 9  # (op, item, first, last)
+
+BACKGROUND = '#d9d9d9'
+
+_NAMED_COLORS = {
+    'white': (255, 255, 255), 'black': (0, 0, 0), 'red': (255, 0, 0),
+    'green': (0, 255, 0), 'blue': (0, 0, 255), 'yellow': (255, 255, 0),
+}
+
+
+def ParseColor(color):
+  """Returns the (r, g, b) of a Tk color name or '#rrggbb' string."""
+  if color in _NAMED_COLORS:
+    return _NAMED_COLORS[color]
+  if color and color.startswith('#') and len(color) == 7:
+    return tuple(int(color[i:i + 2], 16) for i in (1, 3, 5))
+  if color and color.startswith('#') and len(color) == 4:
+    return tuple(int(color[i], 16) * 17 for i in (1, 2, 3))
+  return (128, 128, 128)
+
+
+class _Item(object):
+  __slots__ = ('kind', 'coords', 'options', 'tags')
+
+  def __init__(self, kind, coords, options):
+    self.kind = kind
+    self.coords = tuple(coords)
+    self.tags = options.pop('tags', ())
+    if isinstance(self.tags, str):
+      self.tags = (self.tags,)
+    self.options = options
+
+
+class TraceCanvas(object):
+  """In-memory replacement for the parts of Tkinter.Canvas PianoOutput uses.
+
+  Attributes:
+    width, height: Size of the canvas, in pixels.
+    frames: List of traced frames, one per update(). Each frame is a list of
+        trace entries (see the OP_* constants).
+    frame_stats: List of (number of items, wall time in seconds) for each
+        traced frame, measured at update().
+    pixels: If rasterizing, a bytearray of width * height RGB pixels, as of
+        the last update(). Text is not rasterized.
+  """
+
+  def __init__(self, width, height, rasterize=False):
+    self.width = width
+    self.height = height
+    self.frames = []
+    self.frame_stats = []
+    self.pixels = bytearray(width * height * 3) if rasterize else None
+    self._items = {}
+    self._order = []  # Item ids, bottom first.
+    self._next_item = 1
+    self._ops = []
+    self._frame_start = timeit.default_timer()
+
+  def _Find(self, tag_or_item):
+    if tag_or_item == 'all':
+      return list(self._order)
+    if tag_or_item in self._items:
+      return [tag_or_item]
+    return [item for item in self._order
+            if tag_or_item in self._items[item].tags]
+
+  def _Create(self, op, kind, coords, options):
+    item = self._next_item
+    self._next_item += 1
+    self._ops.append((op, item, tuple(coords), dict(options)))
+    self._items[item] = _Item(kind, coords, options)
+    self._order.append(item)
+    return item
+
+  def create_rectangle(self, *coords, **options):
+    return self._Create(OP_CREATE_RECTANGLE, 'rectangle', coords, options)
+
+  def create_text(self, *coords, **options):
+    return self._Create(OP_CREATE_TEXT, 'text', coords, options)
+
+  def delete(self, tag_or_item):
+    self._ops.append((OP_DELETE, tag_or_item))
+    for item in self._Find(tag_or_item):
+      del self._items[item]
+      self._order.remove(item)
+
+  def find_all(self):
+    return tuple(self._order)
+
+  def cget(self, option):
+    if option in ('background', 'bg'):
+      return BACKGROUND
+    raise ValueError('Unsupported option %s' % option)
+
+  def coords(self, item, *coords):
+    if not coords:
+      return list(self._items[item].coords)
+    self._ops.append((OP_COORDS, item, coords))
+    self._items[item].coords = coords
+
+  def itemconfig(self, item, **options):
+    self._ops.append((OP_ITEMCONFIG, item, options))
+    for target in self._Find(item):
+      self._items[target].options.update(options)
+
+  def move(self, tag_or_item, dx, dy):
+    self._ops.append((OP_MOVE, tag_or_item, dx, dy))
+    for item in self._Find(tag_or_item):
+      coords = self._items[item].coords
+      self._items[item].coords = tuple(
+          c + (dy if i % 2 else dx) for i, c in enumerate(coords))
+
+  def tag_lower(self, item, below):
+    self._ops.append((OP_TAG_LOWER, item, below))
+    self._order.remove(item)
+    self._order.insert(self._order.index(below), item)
+
+  def tag_raise(self, item, above):
+    self._ops.append((OP_TAG_RAISE, item, above))
+    self._order.remove(item)
+    self._order.insert(self._order.index(above) + 1, item)
+
+  def insert(self, item, index, text):
+    self._ops.append((OP_INSERT, item, index, text))
+    options = self._items[item].options
+    old_text = options.get('text', '')
+    options['text'] = old_text[:index] + text + old_text[index:]
+
+  def dchars(self, item, first, last=None):
+    self._ops.append((OP_DCHARS, item, first, last))
+    options = self._items[item].options
+    old_text = options.get('text', '')
+    options['text'] = old_text[:first] + old_text[
+        (first if last is None else last) + 1:]
+
+  def update(self):
+    """Ends the traced frame, and rasterizes the items if requested."""
+    if self.pixels is not None:
+      self.Rasterize()
+    now = timeit.default_timer()
+    self.frames.append(self._ops)
+    self.frame_stats.append((len(self._order), now - self._frame_start))
+    self._ops = []
+    self._frame_start = now
+
+  def Rasterize(self):
+    """Draws all visible rectangles into |pixels|, with their outlines."""
+    row_bytes = self.width * 3
+    self.pixels[:] = bytearray(ParseColor(BACKGROUND)) * (
+        self.width * self.height)
+    for item in self._order:
+      item = self._items[item]
+      if item.kind != 'rectangle' or item.options.get('state') == 'hidden':
+        continue
+      x1, x2 = sorted(item.coords[0::2])
+      y1, y2 = sorted(item.coords[1::2])
+      x1, x2 = max(0, int(x1)), min(self.width, int(x2) + 1)
+      y1, y2 = max(0, int(y1)), min(self.height, int(y2) + 1)
+      if x1 >= x2 or y1 >= y2:
+        continue
+      fill = item.options.get('fill')
+      outline = item.options.get('outline', 'black')
+      width = x2 - x1
+      if fill:
+        fill_row = bytearray(ParseColor(fill)) * width
+        for y in xrange(y1, y2):
+          self.pixels[y * row_bytes + x1 * 3:y * row_bytes + x2 * 3] = fill_row
+      if outline:
+        color = bytearray(ParseColor(outline))
+        line = color * width
+        for y in (y1, y2 - 1):
+          self.pixels[y * row_bytes + x1 * 3:y * row_bytes + x2 * 3] = line
+        for y in xrange(y1, y2):
+          for x in (x1, x2 - 1):
+            self.pixels[y * row_bytes + x * 3:y * row_bytes + x * 3 + 3] = color
+
+  def SaveTrace(self, fname):
+    with open(fname, 'wb') as f:
+      f.write(zlib.compress(pickle.dumps(
+          (TRACE_VERSION, self.width, self.height, self.frames),
+          pickle.HIGHEST_PROTOCOL)))
+
+
+def LoadTrace(fname):
+  """Returns the (width, height, frames) of a trace saved by SaveTrace."""
+  with open(fname, 'rb') as f:
+    version, width, height, frames = pickle.loads(zlib.decompress(f.read()))
+  if version != TRACE_VERSION:
+    raise ValueError('%s has trace version %d, expected %d' % (
+        fname, version, TRACE_VERSION))
+  return width, height, frames
+
+
+def ReplayFrame(canvas, frame, items):
+  """Replays the entries of a traced frame on |canvas|. |items| maps the
+  item ids of the trace to those of the canvas, and is updated."""
+  for entry in frame:
+    op = entry[0]
+    if op == OP_CREATE_RECTANGLE:
+      items[entry[1]] = canvas.create_rectangle(*entry[2], **entry[3])
+    elif op == OP_CREATE_TEXT:
+      items[entry[1]] = canvas.create_text(*entry[2], **entry[3])
+    elif op == OP_DELETE:
+      canvas.delete(items.get(entry[1], entry[1]))
+    elif op == OP_COORDS:
+      canvas.coords(items[entry[1]], *entry[2])
+    elif op == OP_ITEMCONFIG:
+      canvas.itemconfig(items[entry[1]], **entry[2])
+    elif op == OP_MOVE:
+      canvas.move(items.get(entry[1], entry[1]), entry[2], entry[3])
+    elif op == OP_TAG_LOWER:
+      canvas.tag_lower(items[entry[1]], items[entry[2]])
+    elif op == OP_TAG_RAISE:
+      canvas.tag_raise(items[entry[1]], items[entry[2]])
+    elif op == OP_INSERT:
+      canvas.insert(items[entry[1]], entry[2], entry[3])
+    elif op == OP_DCHARS:
+      canvas.dchars(items[entry[1]], entry[2], entry[3])
+  canvas.update()
+
+
+class HeadlessPianoOutput(piano_output.PianoOutput):
+  """PianoOutput drawing on a TraceCanvas instead of a fullscreen window.
+
+  Attributes (in addition to inherited attributes):
+    canvas: The TraceCanvas drawn on.
+  """
+
+  def __init__(self, screen_width=1280, screen_height=800, rasterize=False,
+               profile=None):
+    self._SetScreenSize(screen_width, screen_height, profile)
+    self._AttachCanvas(TraceCanvas(self.CANVAS_WIDTH, self.CANVAS_HEIGHT,
+                                   rasterize=rasterize))
+
+  def WaitForInput(self, user_input, timeout=None):
+    return user_input.Wait(timeout)
@@ -0,0 +1,102 @@
+"""Playback position within a song.
+
+Copyright 2015 Google Inc. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import midi
+
+
+class PlaybackCursor(object):
+  """Walks through the events of a track without modifying them.
+
+  A parsed midi.MidiFile is read-only, so any number of cursors can play the
+  same song, and a song can be replayed by resetting its cursor. Events are
+  read from the arrays of their midi.MidiEventColumns, without building a
+  midi.MidiEvent per event.
+
+  Attributes:
+    events: midi.MidiEventColumns, or midi.StreamingTimeline, played.
+    time: Time in midi ticks since start of file. Fractional if the cursor
+        was advanced by fractional deltas.
+    n_event: Ordinal of first midi event occurring at or after self.time.
+    event_offset: Number of ticks of the delta of event n_event that have
+        already elapsed.
+    event_time: Time in midi ticks of the last event passed, always an
+        integer: self.time - self.event_offset.
+    state: List of 256 ints indicating which note is currently pressed.
+        -1: note is not currently playing.
+        nonnegative: note has been playing since specified time, the
+        (integer) time of its note-on event.
+  """
+
+  def __init__(self, events):
+    self.events = events
+    self.Reset()
+
+  def Reset(self):
+    """Rewinds to the start of the song."""
+    self.time = 0
+    self.n_event = 0
+    self.event_offset = 0
+    self.event_time = 0
+    self.state = [-1] * 256
+
+  def EndOfSong(self):
+    return self.n_event >= len(self.events)
+
+  def Advance(self, delta):
+    """Advances the cursor by delta ticks. Returns a list of
+    (time, note, playing) for the notes that started or stopped playing."""
+    changes = []
+    columns, base = EventColumns(self.events)
+    deltas, times = columns.delta, columns.time
+    cmds, notes, ignore_me = columns.cmd, columns.note, columns.ignore_me
+    state = self.state
+    num_events = base + len(columns)
+    while self.n_event < num_events:
+      i = self.n_event - base
+      remaining = deltas[i] - self.event_offset
+      if remaining >= delta:
+        self.event_offset += delta
+        self.time += delta
+        break
+      self.time += remaining
+      delta -= remaining
+      self.n_event += 1
+      self.event_offset = 0
+      self.event_time = times[i]
+      if ignore_me[i]:
+        continue
+      cmd = cmds[i]
+      if cmd == 0x80:
+        note = notes[i]
+        if state[note] >= 0:
+          changes.append((self.time, note, False))
+        state[note] = -1
+      elif cmd == 0x90:
+        note = notes[i]
+        if state[note] < 0:
+          changes.append((self.time, note, True))
+        state[note] = self.event_time
+    return changes
+
+
+def EventColumns(events):
+  """Returns (columns, base) for a midi.MidiEventColumns or a
+  midi.StreamingTimeline: the midi.MidiEventColumns holding the events, and
+  the index of its first event in |events|."""
+  if isinstance(events, midi.StreamingTimeline):
+    return events.window, events.base
+  return events, 0
@@ -0,0 +1,115 @@
+"""Scoring of the user's playing against the notes of the song.
+
+Copyright 2015 Google Inc. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import heapq
+
+# Points per second for each note pressed while the song plays it, and for
+# each note either pressed or played by the song, but not both. Both are
+# divided by the square of the slowdown factor.
+GAIN_PER_SEC = 4500.0
+LOSS_PER_SEC = 750.0
+
+
+class ScoreKeeper(object):
+  """Integrates the score over time from timestamped note events.
+
+  Expected notes (played by the song) and pressed notes (played by the user)
+  are tracked as sets. Between two events, the score changes at a constant
+  rate set by the number of notes in both sets, and in only one of them. So
+  the score does not depend on the frame rate, and a key pressed and released
+  between two frames still counts. Events may be added out of order, as long
+  as they are not older than |time|; each event only touches its own note.
+
+  Attributes:
+    score: Score integrated up to |time|.
+    time: Time (in seconds) up to which the score is integrated.
+    slowdown_factor: Playback slowdown the scoring rates are adjusted for.
+  """
+
+  EXPECTED = 0
+  PRESSED = 1
+
+  def __init__(self, slowdown_factor=1.0, time=0.0):
+    self.score = 0.0
+    self.time = time
+    self.SetSlowdown(slowdown_factor)
+    self._notes = (set(), set())  # Expected notes, pressed notes.
+    self._num_correct = 0  # Notes both expected and pressed.
+    self._num_wrong = 0  # Notes either expected or pressed.
+    self._events = []  # Heap of (time, ordinal, kind, note, on).
+    self._num_events = 0
+
+  def SetSlowdown(self, slowdown_factor):
+    self.slowdown_factor = slowdown_factor
+    self._gain_per_sec = GAIN_PER_SEC / slowdown_factor / slowdown_factor
+    self._loss_per_sec = LOSS_PER_SEC / slowdown_factor / slowdown_factor
+
+  def Expect(self, time, note, on):
+    """Records that the song starts (or stops) playing |note| at |time|."""
+    self._AddEvent(time, self.EXPECTED, note, on)
+
+  def Press(self, time, note, on):
+    """Records that the user presses (or releases) |note| at |time|."""
+    self._AddEvent(time, self.PRESSED, note, on)
+
+  def _AddEvent(self, time, kind, note, on):
+    heapq.heappush(self._events, (max(time, self.time), self._num_events,
+                                  kind, note, on))
+    self._num_events += 1
+
+  def AdvanceTo(self, time):
+    """Integrates the score up to |time|, applying the events before it."""
+    while self._events and self._events[0][0] <= time:
+      event_time, _, kind, note, on = heapq.heappop(self._events)
+      self._Integrate(event_time)
+      self._Apply(kind, note, on)
+    self._Integrate(time)
+
+  def Resume(self, time):
+    """Continues scoring from |time| after a pause: the time since the last
+    update is not scored, and all keys are considered released."""
+    self.AdvanceTo(self.time)
+    self.time = max(self.time, time)
+    for note in list(self._notes[self.PRESSED]):
+      self._Apply(self.PRESSED, note, False)
+
+  def _Integrate(self, time):
+    if time > self.time:
+      self.score += (time - self.time) * (
+          self._num_correct * self._gain_per_sec -
+          self._num_wrong * self._loss_per_sec)
+      self.time = time
+
+  def _Apply(self, kind, note, on):
+    notes = self._notes[kind]
+    if (note in notes) == on:
+      return
+    other = note in self._notes[1 - kind]
+    if on:
+      notes.add(note)
+      if other:
+        self._num_correct += 1
+        self._num_wrong -= 1
+      else:
+        self._num_wrong += 1
+    else:
+      notes.remove(note)
+      if other:
+        self._num_correct -= 1
+        self._num_wrong += 1
+      else:
+        self._num_wrong -= 1
@@ -0,0 +1,151 @@
+"""Persistent on-disk cache of parsed MIDI files.
+
+Parsing a MIDI file is slow compared to loading a pickle of the parsed
+result, so the menu loads songs through a SongCache. Each entry holds a
+compact (midi.MidiEventColumns based) midi.MidiFile, and is validated against
+the size, mtime and content hash of the MIDI file it was built from.
+
+Copyright 2015 Google Inc. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import cPickle as pickle
+import hashlib
+import os
+import tempfile
+import zlib
+
+import midi
+
+# Bump whenever the pickled form of midi.MidiFile changes.
+CACHE_VERSION = 2
+
+
+def FileHash(fname):
+  with open(fname, 'rb') as f:
+    return hashlib.sha1(f.read()).hexdigest()
+
+
+class SongCache(object):
+  """Caches parsed MIDI files in a directory.
+
+  Each entry is a file containing two pickles: a small header
+  (version, size, mtime, content hash) used for validation, followed by the
+  zlib-compressed pickle of the parsed midi.MidiFile. The content hash is
+  only compared when the mtime of the song changed. When the total size of
+  the entries exceeds |max_bytes|, the least recently used entries are
+  removed.
+
+  Attributes:
+    directory: Directory holding the cache entries.
+    max_bytes: Maximal total size of the cache entries, in bytes.
+    pool: Optional multiprocessing.Pool used to parse the tracks of songs that
+        are not cached yet.
+  """
+
+  def __init__(self, directory='.song_cache', max_bytes=64 << 20, pool=None):
+    self.directory = directory
+    self.max_bytes = max_bytes
+    self.pool = pool
+    if not os.path.isdir(directory):
+      os.makedirs(directory)
+
+  def _EntryPath(self, fname):
+    key = hashlib.sha1(os.path.abspath(fname)).hexdigest()
+    return os.path.join(self.directory, key + '.pickle')
+
+  def Load(self, fname):
+    """Returns the midi.MidiFile for |fname|, parsing it only if there is no
+    valid cache entry for it."""
+    stat = os.stat(fname)
+    entry_path = self._EntryPath(fname)
+    midi_file = self._ReadEntry(entry_path, fname, stat)
+    if midi_file is None:
+      midi_file = midi.MidiFile(fname, compact=True, pool=self.pool)
+      self._WriteEntry(entry_path, stat, FileHash(fname), midi_file)
+      self._Evict()
+    return midi_file
+
+  def _ReadEntry(self, entry_path, fname, stat):
+    """Returns the midi.MidiFile of the entry of |fname|, or None if it has
+    no valid entry. The file is only hashed if its mtime changed since it
+    was cached. Entries which cannot be read are removed."""
+    try:
+      with open(entry_path, 'rb') as f:
+        version, size, mtime, content_hash = pickle.load(f)
+        if version != CACHE_VERSION or size != stat.st_size:
+          return None
+        touched = mtime != stat.st_mtime
+        if touched and content_hash != FileHash(fname):
+          return None
+        midi_file = pickle.loads(zlib.decompress(pickle.load(f)))
+    except IOError:
+      return None  # No entry.
+    except (EOFError, pickle.UnpicklingError, zlib.error, AttributeError,
+            ImportError, TypeError, ValueError) as ex:
+      # Truncated, or pickled from an older layout of the classes.
+      print 'Warning: Discarding song cache entry %s (%s)' % (entry_path, ex)
+      try:
+        os.remove(entry_path)
+      except OSError:
+        pass
+      return None
+    if touched:
+      # Same content, new mtime: record it, so that the file is not hashed
+      # again.
+      self._WriteEntry(entry_path, stat, content_hash, midi_file)
+    else:
+      os.utime(entry_path, None)  # Mark entry as recently used.
+    return midi_file
+
+  def _WriteEntry(self, entry_path, stat, content_hash, midi_file):
+    # Write to a temporary file first, so that a concurrent or interrupted
+    # writer never leaves a truncated entry behind.
+    fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+    try:
+      with os.fdopen(fd, 'wb') as f:
+        pickle.dump(
+            (CACHE_VERSION, stat.st_size, stat.st_mtime, content_hash), f,
+            pickle.HIGHEST_PROTOCOL)
+        pickle.dump(
+            zlib.compress(pickle.dumps(midi_file, pickle.HIGHEST_PROTOCOL), 1),
+            f, pickle.HIGHEST_PROTOCOL)
+      os.rename(temp_path, entry_path)
+    except (IOError, OSError) as ex:
+      print 'Warning: Could not write song cache entry (%s)' % ex
+      if os.path.exists(temp_path):
+        os.remove(temp_path)
+
+  def _Evict(self):
+    """Removes least recently used entries until the cache fits max_bytes."""
+    entries = []
+    total_bytes = 0
+    for name in os.listdir(self.directory):
+      if not name.endswith('.pickle'):
+        continue
+      path = os.path.join(self.directory, name)
+      try:
+        stat = os.stat(path)
+      except OSError:
+        continue  # Removed concurrently.
+      entries.append((stat.st_mtime, stat.st_size, path))
+      total_bytes += stat.st_size
+    entries.sort()
+    while total_bytes > self.max_bytes and entries:
+      _, size, path = entries.pop(0)
+      try:
+        os.remove(path)
+      except OSError:
+        pass
+      total_bytes -= size
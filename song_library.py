@@ -0,0 +1,134 @@
+"""Index of the MIDI files in the song directory, with metadata about each song.
+
+The index is kept in a pickle file next to the songs. The first scan parses
+every song in a pool of processes; later scans only parse files whose size or
+mtime changed.
+
+Copyright 2015 Google Inc. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import collections
+import multiprocessing
+import os
+import pickle
+import sys
+
+import midi
+
+# Bump whenever the fields of SongInfo change.
+INDEX_VERSION = 1
+
+# Metadata about a song. Times are in seconds, tempos in beats per minute.
+SongInfo = collections.namedtuple('SongInfo', [
+    'size', 'mtime', 'parse_error', 'duration', 'num_notes', 'lowest_note',
+    'highest_note', 'num_tracks', 'min_tempo', 'max_tempo'])
+
+
+def GetSongInfo(fname):
+  """Parses a MIDI file and returns its SongInfo."""
+  stat = os.stat(fname)
+  try:
+    midi_file = midi.MidiFile(fname, compact=True)
+  except Exception as ex:
+    print >>sys.stderr, 'Error: Could not parse %s (%s)' % (fname, ex)
+    return SongInfo(stat.st_size, stat.st_mtime, True, 0.0, 0, -1, -1, 0, 0.0,
+                    0.0)
+  num_notes = 0
+  notes = set()
+  end_time = 0
+  for track in midi_file.tracks:
+    if len(track.events):
+      end_time = max(end_time, track.events.time[-1])
+    for i in xrange(len(track.events)):
+      if track.events.cmd[i] == 0x90 and not track.events.ignore_me[i]:
+        num_notes += 1
+        notes.add(track.events.note[i])
+  beats_per_minute = [
+      60.0 * tempo / midi_file.header.ticks_per_note
+      for _, tempo in midi_file.tempo_map]
+  return SongInfo(stat.st_size, stat.st_mtime, False,
+                  midi_file.tempo.TicksToSeconds(end_time), num_notes,
+                  min(notes) if notes else -1, max(notes) if notes else -1,
+                  len(midi_file.tracks), min(beats_per_minute),
+                  max(beats_per_minute))
+
+
+def _SilenceOutput():
+  """Pool initializer; hides the progress messages of the MIDI parser."""
+  sys.stdout = open(os.devnull, 'w')
+
+
+class SongLibrary(object):
+  """The MIDI files of a directory, along with their SongInfo.
+
+  Attributes:
+    path: Directory holding the MIDI files.
+    index_file: File name of the persisted index.
+    songs: Dict mapping file names (relative to path) to SongInfo objects.
+  """
+
+  def __init__(self, path='./', index_file='.library_index.pickle'):
+    self.path = path
+    self.index_file = os.path.join(path, index_file)
+    self.songs = {}
+    try:
+      with open(self.index_file, 'rb') as f:
+        version, songs = pickle.load(f)
+      if version == INDEX_VERSION:
+        self.songs = songs
+    except (IOError, EOFError, ValueError, pickle.UnpicklingError):
+      print 'Warning: Could not read song library index, rebuilding it.'
+
+  def Update(self, processes=None):
+    """Rescans the directory, parsing only new or modified MIDI files in a
+    pool of |processes| processes (default: one per CPU)."""
+    stats = {}
+    for fname in os.listdir(self.path):
+      if fname.lower().endswith('.mid'):
+        stats[fname] = os.stat(os.path.join(self.path, fname))
+    changed = sorted(
+        fname for fname, stat in stats.iteritems()
+        if fname not in self.songs or
+        (self.songs[fname].size, self.songs[fname].mtime) !=
+        (stat.st_size, stat.st_mtime))
+    removed = [fname for fname in self.songs if fname not in stats]
+    for fname in removed:
+      del self.songs[fname]
+    if changed:
+      print 'Indexing %d songs...' % len(changed)
+      pool = multiprocessing.Pool(processes, initializer=_SilenceOutput)
+      try:
+        infos = pool.map(GetSongInfo,
+                         [os.path.join(self.path, fname) for fname in changed])
+      finally:
+        pool.close()
+        pool.join()
+      self.songs.update(zip(changed, infos))
+    if changed or removed:
+      self.Save()
+
+  def Save(self):
+    try:
+      with open(self.index_file, 'wb') as f:
+        pickle.dump((INDEX_VERSION, self.songs), f, pickle.HIGHEST_PROTOCOL)
+    except IOError:
+      print 'Error: Failed to save song library index %s' % self.index_file
+
+  def GetSongs(self):
+    """Returns the file names of all playable songs, sorted by name."""
+    return sorted(
+        (fname for fname, info in self.songs.iteritems()
+         if not info.parse_error),
+        key=lambda f: f.lower())
@@ -0,0 +1,100 @@
+"""Background loading of songs, so that switching songs in the menu is instant.
+
+Copyright 2015 Google Inc. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import collections
+import threading
+
+
+class SongPrefetcher(object):
+  """Loads songs ahead of time in a small pool of worker threads.
+
+  Loaded songs are kept in a bounded in-memory LRU cache. Prefetch() replaces
+  the list of songs waiting to be loaded, so requests that went stale (e.g.
+  because the user scrolled past them) are cancelled before they start.
+
+  Attributes:
+    loader: Function taking a key and returning the loaded song.
+    capacity: Maximal number of loaded songs kept in memory.
+  """
+
+  def __init__(self, loader, num_workers=2, capacity=8):
+    self.loader = loader
+    self.capacity = capacity
+    self._lock = threading.Condition()
+    self._loaded = collections.OrderedDict()  # Least recently used first.
+    self._loading = set()
+    self._wanted = []
+    for _ in xrange(num_workers):
+      worker = threading.Thread(target=self._Work)
+      worker.daemon = True
+      worker.start()
+
+  def Prefetch(self, keys):
+    """Requests loading of |keys| in the background, in the given order.
+    Any previously requested key that has not started loading is dropped."""
+    with self._lock:
+      self._wanted = [key for key in keys
+                      if key not in self._loaded and key not in self._loading]
+      self._lock.notify_all()
+
+  def Get(self, key):
+    """Returns the song for |key|, loading it now if it is not loaded yet."""
+    with self._lock:
+      while key in self._loading:
+        self._lock.wait()
+      if key in self._loaded:
+        song = self._loaded.pop(key)
+        self._loaded[key] = song  # Mark as most recently used.
+        return song
+      if key in self._wanted:
+        self._wanted.remove(key)
+      self._loading.add(key)
+    try:
+      song = self.loader(key)
+      self._Store(key, song)
+    finally:
+      self._Done(key)
+    return song
+
+  def _Work(self):
+    while True:
+      with self._lock:
+        while not self._wanted:
+          self._lock.wait()
+        key = self._wanted.pop(0)
+        self._loading.add(key)
+      try:
+        song = self.loader(key)
+      except Exception as ex:
+        # Get() will try again, and report the error to its caller.
+        print 'Warning: Failed to prefetch %s (%s)' % (key, ex)
+        self._Done(key)
+        continue
+      self._Store(key, song)
+      self._Done(key)
+
+  def _Store(self, key, song):
+    with self._lock:
+      self._loaded.pop(key, None)
+      self._loaded[key] = song
+      while len(self._loaded) > self.capacity:
+        self._loaded.popitem(last=False)
+
+  def _Done(self, key):
+    with self._lock:
+      self._loading.discard(key)
+      self._lock.notify_all()
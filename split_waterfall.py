@@ -0,0 +1,318 @@
+"""Plays a song with input and scoring in one process, and drawing in another.
+
+Usage:
+  python split_waterfall.py <song.mid> [--hand HAND] [--slowdown F]
+                            [--core-rate N] [--fps N] [--calibration FILE]
+
+The core process (the main one) owns the piano input and the playback cursor,
+and scores the user's playing. After every step, it publishes the state of the
+song (tick, held and playing notes, score) to a FrameChannel in shared memory.
+The render process runs PianoOutput, and draws the latest published state at
+its own frame rate. So a slow canvas.update() no longer delays input sampling
+and scoring, and the Tk drawing does not compete with the USB reader thread
+for the GIL.
+
+Copyright 2015 Google Inc. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import argparse
+import ctypes
+import multiprocessing
+import multiprocessing.sharedctypes
+
+import key_geometry
+import latency
+import midi
+import piano_input
+import piano_input_mock
+import piano_output
+import waterfall
+
+NUM_NOTES = 128
+
+# Flags of a published frame.
+FLAG_DONE = 1  # Last frame: the song ended, or the user requested the menu.
+
+
+class FrameState(ctypes.Structure):
+  """State of the song published for a frame."""
+  _fields_ = [('sequence', ctypes.c_uint64),  # Odd while being written.
+              ('frame', ctypes.c_uint64),  # Ordinal of the frame.
+              ('tick', ctypes.c_double),  # Song time.
+              ('score', ctypes.c_double),
+              # Capture timestamp of the last input processed, or 0.
+              ('input_time', ctypes.c_double),
+              ('flags', ctypes.c_uint32),
+              ('active', ctypes.c_uint8 * NUM_NOTES),  # 1 for held notes.
+              ('playing', ctypes.c_uint8 * NUM_NOTES)]  # 1 for song notes.
+
+  def Notes(self, field):
+    """Returns the set of notes flagged in the |field| array."""
+    flags = bytearray(getattr(self, field))
+    return set(note for note in xrange(NUM_NOTES) if flags[note])
+
+
+_SEQUENCE_SIZE = ctypes.sizeof(ctypes.c_uint64)
+
+
+class FrameChannel(object):
+  """Ring buffer of FrameStates in shared memory, written by one process and
+  read by others.
+
+  Each slot is guarded by a sequence lock: the writer makes the sequence
+  number of the slot odd before writing it, and even again after. A reader
+  copies the slot, and retries if the sequence number was odd or changed in
+  the meantime. So the writer never waits for readers, and readers only wait
+  for a write in progress. Readers only want the last frame; the ring lets
+  the writer go on publishing while a reader is still copying an older one.
+
+  The memory comes from multiprocessing.sharedctypes, so the channel must be
+  created before the processes using it are forked. The sequence lock relies
+  on the stores of the writer becoming visible to readers in program order,
+  as on x86.
+
+  Attributes:
+    num_slots: Number of frames in the ring.
+  """
+
+  def __init__(self, num_slots=4):
+    self.num_slots = num_slots
+    self._slots = multiprocessing.sharedctypes.RawArray(FrameState, num_slots)
+    # Number of frames published.
+    self._count = multiprocessing.sharedctypes.RawValue(ctypes.c_uint64, 0)
+    self._staging = FrameState()  # Frame being prepared by the writer.
+
+  def Publish(self, tick, score, active_notes, playing_notes, input_time,
+              flags=0):
+    """Publishes the state of the next frame. Only one process may publish.
+    |input_time| may be None if no input was processed yet."""
+    staging = self._staging
+    frame = self._count.value
+    staging.frame = frame
+    staging.tick = tick
+    staging.score = score
+    staging.input_time = input_time or 0.0
+    staging.flags = flags
+    for field, notes in (('active', active_notes), ('playing', playing_notes)):
+      flagged = bytearray(NUM_NOTES)
+      for note in notes:
+        flagged[note] = 1
+      ctypes.memmove(getattr(staging, field), str(flagged), NUM_NOTES)
+
+    slot = self._slots[frame % self.num_slots]
+    slot.sequence += 1
+    ctypes.memmove(ctypes.addressof(slot) + _SEQUENCE_SIZE,
+                   ctypes.addressof(staging) + _SEQUENCE_SIZE,
+                   ctypes.sizeof(FrameState) - _SEQUENCE_SIZE)
+    slot.sequence += 1
+    self._count.value = frame + 1
+
+  def Latest(self):
+    """Returns a copy of the last published FrameState, or None if no frame
+    was published yet."""
+    state = FrameState()
+    while True:
+      count = self._count.value
+      if not count:
+        return None
+      slot = self._slots[(count - 1) % self.num_slots]
+      sequence = slot.sequence
+      if sequence % 2:
+        continue  # Being written.
+      ctypes.memmove(ctypes.addressof(state), ctypes.addressof(slot),
+                     ctypes.sizeof(FrameState))
+      if slot.sequence == sequence:
+        return state
+
+
+class _CoreOutput(object):
+  """Stands in for the PianoOutput of the core process, which draws nothing.
+
+  Attributes:
+    LOWEST_NOTE, HIGHEST_NOTE: Key range of the keyboard, for the menu
+        request gesture.
+    CANVAS_HEIGHT, KEYBOARD_HEIGHT: Nominal canvas layout. Only used for
+        drawing.
+    canvas: None, as nothing is drawn.
+    input_latency: latency.InputLatency, where the capture to display
+        latency is measured up to the publication of the frame.
+  """
+
+  def __init__(self, profile=None):
+    profile = profile or key_geometry.CalibrationProfile()
+    self.LOWEST_NOTE = profile.lowest_note
+    self.HIGHEST_NOTE = profile.highest_note
+    self.KEYBOARD_HEIGHT = 0
+    self.CANVAS_HEIGHT = 300
+    self.canvas = None
+    self.input_latency = latency.InputLatency()
+
+
+class CoreWaterfall(waterfall.Waterfall):
+  """Waterfall which publishes the state of its frames to a FrameChannel
+  instead of drawing them. Songs must not be lazily loaded.
+
+  Attributes (in addition to inherited attributes):
+    channel: FrameChannel the frames are published to.
+  """
+
+  def __init__(self, channel, piano_input, midi_file, hand='both',
+               frames_per_sec=250, clock_obj=None, profile=None):
+    if midi_file.lazy:
+      raise ValueError('Lazily loaded songs cannot be played split')
+    waterfall.Waterfall.__init__(
+        self, piano_input, _CoreOutput(profile), midi_file, hand=hand,
+        scrolling=False, frames_per_sec=frames_per_sec, clock_obj=clock_obj)
+    self.channel = channel
+
+  def Draw(self):
+    self._Publish()
+
+  def _Publish(self, flags=0):
+    self.channel.Publish(
+        self.cursor.time, self.score, self.active_notes,
+        [note for note in xrange(NUM_NOTES) if self.cursor.state[note] >= 0],
+        self.piano_output.input_latency.latest, flags)
+    self.piano_output.input_latency.Displayed()
+
+  def Continue(self, slowdown_factor=1.0):
+    """Plays as Waterfall.Continue, then publishes a last frame flagged
+    FLAG_DONE. Returns the score."""
+    score = waterfall.Waterfall.Continue(self, slowdown_factor)
+    self._Publish(FLAG_DONE)
+    return score
+
+
+class _MirrorCursor(object):
+  """Song position copied from a FrameState, with the attributes of
+  playback.PlaybackCursor that drawing uses."""
+
+  def __init__(self):
+    self.time = 0
+    self.state = [-1] * 256
+
+
+class RenderWaterfall(waterfall.Waterfall):
+  """Waterfall drawing the frames published to a FrameChannel by a
+  CoreWaterfall playing the same song with the same hand.
+
+  Attributes (in addition to inherited attributes):
+    channel: FrameChannel the frames are read from.
+    shown_score: Score of the frame shown.
+  """
+
+  def __init__(self, channel, piano_output, midi_file, hand='both',
+               scrolling=True, frames_per_sec=60, clock_obj=None):
+    waterfall.Waterfall.__init__(
+        self, None, piano_output, midi_file, hand=hand, scrolling=scrolling,
+        frames_per_sec=frames_per_sec, clock_obj=clock_obj)
+    self.channel = channel
+    self.cursor = _MirrorCursor()
+    self.shown_score = 0.0
+    self._input_time = 0.0
+
+  @property
+  def score(self):
+    return self.shown_score
+
+  def ShowFrame(self, state):
+    """Moves the waterfall to a published FrameState. Of the input processed
+    since the previous frame shown, only the latency of the last event is
+    measured."""
+    self.cursor.time = state.tick
+    playing = state.Notes('playing')
+    self.cursor.state = [0 if note in playing else -1 for note in xrange(256)]
+    self.active_notes = state.Notes('active')
+    self.shown_score = state.score
+    if state.input_time and state.input_time != self._input_time:
+      self._input_time = state.input_time
+      self.piano_output.input_latency.Processed(state.input_time)
+
+  def Play(self):
+    """Draws the last published frame at most |frames_per_sec| times per
+    second, until the last frame of the core was drawn. Returns the score."""
+    frame_period = 1.0 / self.frames_per_sec
+    next_frame_time = self.clock.Now()
+    shown_frame = None
+    while True:
+      state = self.channel.Latest()
+      if state is not None and state.frame != shown_frame:
+        shown_frame = state.frame
+        self.ShowFrame(state)
+        self.Draw()
+        if state.flags & FLAG_DONE:
+          return self.score
+
+      next_frame_time += frame_period
+      now = self.clock.Now()
+      if now < next_frame_time:
+        self.clock.Sleep(next_frame_time - now)
+      else:
+        late_frames = int((now - next_frame_time) / frame_period)
+        self.dropped_frames += late_frames
+        next_frame_time += late_frames * frame_period
+
+
+def _Render(channel, midi_file, hand, frames_per_sec, profile):
+  """Main function of the render process."""
+  output = piano_output.PianoOutput(profile)
+  render = RenderWaterfall(channel, output, midi_file, hand=hand,
+                           frames_per_sec=frames_per_sec)
+  render.Play()
+  print 'Render process dropped %d frames.' % render.dropped_frames
+  output.input_latency.Print()
+
+
+def main():
+  parser = argparse.ArgumentParser(
+      description=__doc__.split('\n\n')[2].replace('\n', ' '))
+  parser.add_argument('song')
+  parser.add_argument('--hand', default='both',
+                      choices=('both', 'right', 'left'))
+  parser.add_argument('--slowdown', type=float, default=1.0)
+  parser.add_argument('--core-rate', type=int, default=250,
+                      help='steps per second of input and scoring')
+  parser.add_argument('--fps', type=int, default=60,
+                      help='frames per second drawn')
+  parser.add_argument('--calibration',
+                      help='key_geometry calibration profile')
+  args = parser.parse_args()
+
+  midi_file = midi.MidiFile(args.song)
+  profile = None
+  if args.calibration:
+    profile = key_geometry.LoadProfile(args.calibration)
+  channel = FrameChannel()
+  # Forked before the input thread starts. The render process opens its own
+  # Tk window, which the core process never touches.
+  render = multiprocessing.Process(
+      target=_Render, args=(channel, midi_file, args.hand, args.fps, profile))
+  render.daemon = True
+  render.start()
+
+  try:
+    piano_input_obj = piano_input.PianoInput()
+  except IOError:
+    print 'Using mock input instead of usb one.'
+    piano_input_obj = piano_input_mock.PianoInput()
+  core = CoreWaterfall(channel, piano_input_obj, midi_file, hand=args.hand,
+                       frames_per_sec=args.core_rate, profile=profile)
+  score = core.Continue(args.slowdown)
+  render.join()
+  print 'Score: %d' % score
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,147 @@
+"""Records and replays the draw calls of the waterfall, without a display.
+
+Usage:
+  python trace_replay.py record <song.mid> <trace> [--fps N] [--hand HAND]
+                                [--slowdown F] [--no-scrolling] [--rasterize]
+                                [--profile CSV]
+      Plays a song at full speed on a headless PianoOutput, with no input,
+      and saves the draw calls of every frame to <trace>. With --profile,
+      also reports the time of each phase of the frames.
+  python trace_replay.py replay <trace> [--tk] [--rasterize] [--verbose]
+      Replays a trace on a headless canvas (or on a Tk canvas with --tk), and
+      reports the number of draw calls, canvas items and time per frame.
+
+Copyright 2015 Google Inc. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import argparse
+import Queue
+import timeit
+
+import clock
+import frame_profiler
+import midi
+import piano_output_headless
+import waterfall
+
+
+class _NoInput(object):
+  """Piano input which is never played."""
+
+  def __init__(self):
+    self.user_input = Queue.Queue()
+
+
+def PrintStats(num_ops, num_items, frame_times):
+  """Prints a summary of per-frame draw calls, canvas items and times."""
+  def Summary(values, scale=1.0):
+    ordered = sorted(values)
+    return 'mean %.2f, p95 %.2f, max %.2f' % (
+        scale * sum(ordered) / len(ordered),
+        scale * ordered[int(0.95 * (len(ordered) - 1))], scale * ordered[-1])
+  if not frame_times:
+    print 'No frames.'
+    return
+  print 'Frames:           %d' % len(frame_times)
+  print 'Draw calls/frame: %s' % Summary(num_ops)
+  print 'Items/frame:      %s' % Summary(num_items)
+  print 'Time/frame (ms):  %s' % Summary(frame_times, 1000.0)
+
+
+def Record(args):
+  midi_file = midi.MidiFile(args.song)
+  output = piano_output_headless.HeadlessPianoOutput(rasterize=args.rasterize)
+  profiler = None
+  if args.profile:
+    profiler = frame_profiler.FrameProfiler(capacity=1 << 20,
+                                            csv_path=args.profile)
+  waterfall_obj = waterfall.Waterfall(
+      _NoInput(), output, midi_file, hand=args.hand,
+      scrolling=not args.no_scrolling, frames_per_sec=args.fps,
+      clock_obj=clock.SimulatedClock(), profiler=profiler, name=args.song)
+  start = timeit.default_timer()
+  waterfall_obj.Continue(args.slowdown)
+  elapsed = timeit.default_timer() - start
+  canvas = output.canvas
+  canvas.SaveTrace(args.trace)
+  print 'Played %d frames in %.2f s (%.0f frames/s)' % (
+      len(canvas.frames), elapsed, len(canvas.frames) / max(elapsed, 1e-9))
+  PrintStats([len(frame) for frame in canvas.frames],
+             [num_items for num_items, _ in canvas.frame_stats],
+             [frame_time for _, frame_time in canvas.frame_stats])
+
+
+def Replay(args):
+  width, height, frames = piano_output_headless.LoadTrace(args.trace)
+  if args.tk:
+    import Tkinter as tk
+    root = tk.Tk()
+    canvas = tk.Canvas(root, width=width, height=height)
+    canvas.pack()
+  else:
+    canvas = piano_output_headless.TraceCanvas(width, height,
+                                               rasterize=args.rasterize)
+  items = {}
+  num_items = []
+  frame_times = []
+  for i, frame in enumerate(frames):
+    start = timeit.default_timer()
+    piano_output_headless.ReplayFrame(canvas, frame, items)
+    frame_times.append(timeit.default_timer() - start)
+    num_items.append(len(canvas.find_all()))
+    if args.verbose:
+      print 'Frame %5d: %4d draw calls, %4d items, %7.3f ms' % (
+          i, len(frame), num_items[-1], frame_times[-1] * 1000)
+  PrintStats([len(frame) for frame in frames], num_items, frame_times)
+
+
+def main():
+  parser = argparse.ArgumentParser(
+      description=__doc__.split('\n\n')[0],
+      formatter_class=argparse.RawDescriptionHelpFormatter,
+      epilog=__doc__.split('\n\n')[1])
+  commands = parser.add_subparsers()
+
+  record = commands.add_parser('record')
+  record.add_argument('song')
+  record.add_argument('trace')
+  record.add_argument('--fps', type=int, default=60)
+  record.add_argument('--hand', default='both',
+                      choices=('both', 'right', 'left'))
+  record.add_argument('--slowdown', type=float, default=1.0)
+  record.add_argument('--no-scrolling', action='store_true',
+                      help='lay out the note bars again every frame')
+  record.add_argument('--rasterize', action='store_true',
+                      help='also rasterize every frame')
+  record.add_argument('--profile', metavar='CSV',
+                      help='time the phases of each frame, and save the '
+                      'timings to CSV')
+  record.set_defaults(function=Record)
+
+  replay = commands.add_parser('replay')
+  replay.add_argument('trace')
+  replay.add_argument('--tk', action='store_true',
+                      help='replay on a Tk canvas; needs a display')
+  replay.add_argument('--rasterize', action='store_true')
+  replay.add_argument('--verbose', action='store_true',
+                      help='report every frame')
+  replay.set_defaults(function=Replay)
+
+  args = parser.parse_args()
+  args.function(args)
+
+
+if __name__ == '__main__':
+  main()
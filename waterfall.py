@@ -14,10 +14,13 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
-import copy
+import clock
+import frame_profiler
 import midi
+import note_index
+import playback
+import scoring
 import sys
-import time
 import piano_input_mock
 import piano_output
 
@@ -25,68 +28,121 @@ class Waterfall(object):
   """Handles waterfall object.
 
   Attributes:
+    name: Name of the song, for reports.
     midi_file: midi.MidiFile object.
-    midi_track: midi.MidiTrack object for which waterfall will be displayed.
-    state: List of 256 ints indicating which note is currently pressed.
-        -1: note is not currently playing.
-        nonnegative: note has been playing since specified time.
-    time: Time in midi ticks since start of file.
-    n_event: Ordinal of first midi event occurring at or after self.time.
+    hand: Which hand plays: 'left', 'right' or 'both'. Lazily loaded midi
+        files, and songs with a single part, can only be played with both
+        hands.
+    splits_hands: Whether the left and right hands play different parts.
+    events: midi.MidiEventColumns with the note events shown, merged from all
+        tracks of the midi file played by |hand|. For lazily loaded midi
+        files, a midi.StreamingTimeline decoding the events as they near.
+    note_index: note_index.NoteIntervalIndex of the notes in events.
+    cursor: playback.PlaybackCursor holding the playback position in
+        events. The midi file itself is never modified, so it can be shared
+        between waterfalls and replayed without reloading it.
+    score_keeper: scoring.ScoreKeeper scoring the user's playing, in wall
+        clock time.
     score: User's current score.
     piano_output: piano_output.PianoOutput object handling output graphics.
     piano_input: piano_input.PianoInput object handling input from piano.
     active_notes: set of currently pressed notes.
+    scrolling: Whether note bars are drawn on a piano_output.NoteLayer, which
+        is scrolled every frame, instead of being laid out again every frame.
+    frames_per_sec: Number of frames drawn per second of wall time.
+    clock: clock.MonotonicClock (or compatible object) pacing playback.
+    dropped_frames: Number of frames skipped because drawing fell behind.
+    profiler: frame_profiler.FrameProfiler timing the phases of each frame,
+        or frame_profiler.NULL_PROFILER.
+    input_recorder: input_recorder.InputRecorder writing the input processed
+        by Continue, or None.
   """
 
-  def __init__(self, piano_input, piano_output, midi_file):
+  def __init__(self, piano_input, piano_output, midi_file, hand='both',
+               scrolling=True, frames_per_sec=60, clock_obj=None,
+               profiler=None, name='song'):
+    self.name = name
     self.midi_file = midi_file
-    self.midi_track = self._GetLongestTrack(midi_file)
-    self.state = [-1] * 256
-    self.time = 0
-    self.n_event = 0
-    self.score = 0
+    self.hand = hand
+    self.scrolling = scrolling
+    self.frames_per_sec = frames_per_sec
+    self.clock = clock_obj or clock.MonotonicClock()
+    self.dropped_frames = 0
+    self.profiler = profiler or frame_profiler.NULL_PROFILER
+    self.input_recorder = None
+    timeline = midi_file.GetTimeline()
+    if midi_file.lazy:
+      self.splits_hands = False
+      if hand != 'both':
+        print 'Warning: Lazily loaded songs are played with both hands.'
+      self.events = timeline
+      self.note_index = None
+    else:
+      self.splits_hands = timeline.SplitsHands()
+      self.events = timeline.Select(timeline.HandParts(hand))
+      self.note_index = note_index.NoteIntervalIndex.FromEvents(self.events)
+    if not self.splits_hands:
+      self.hand = 'both'
+    self.cursor = playback.PlaybackCursor(self.events)
+    self.score_keeper = scoring.ScoreKeeper()
     self.piano_output = piano_output
     self.piano_input = piano_input
     self.active_notes = set()
+    self._note_layer = None
+    self._note_layer_index = None  # The note_index _note_layer shows.
+    self._next_interval = 0  # First interval of the index not added yet.
+    self._green_notes = set()  # Notes whose bars are green.
 
     self.TICKS_SHOWN = 300  # Total number of ticks shown simultaneously.
     self.PIXELS_PER_TICK = (
         float(self.piano_output.CANVAS_HEIGHT -
               self.piano_output.KEYBOARD_HEIGHT) / self.TICKS_SHOWN)
+    self.DecodeAhead()
 
-  def _GetLongestTrack(self, midi_file):
-    longestTrack = midi_file.tracks[0]
-    for track in midi_file.tracks:
-      if len(longestTrack.events) < len(track.events):
-        longestTrack = track
-    return longestTrack
+  def DecodeAhead(self):
+    """For lazily loaded songs, decodes the events about to be shown, frees
+    those already played, and indexes the notes of the decoded events."""
+    if not self.midi_file.lazy:
+      return
+    num_decoded = len(self.events)
+    self.events.Discard(self.cursor.n_event)
+    self.events.DecodeUntil(self.cursor.time + 2 * self.TICKS_SHOWN)
+    if self.note_index is None or len(self.events) != num_decoded:
+      playing = dict((note, (start, -1))
+                     for note, start in enumerate(self.cursor.state)
+                     if start >= 0)
+      columns, base = playback.EventColumns(self.events)
+      self.note_index = note_index.NoteIntervalIndex(
+          note_index.NoteIntervalsFromEvents(
+              columns, self.cursor.n_event - base, self.cursor.event_time,
+              playing))
 
   def EndOfSong(self):
-    return self.n_event >= len(self.midi_track.events)
+    if self.midi_file.lazy and not self.events.done:
+      return False
+    return self.cursor.EndOfSong()
+
+  def Restart(self):
+    """Rewinds the song to its beginning and resets the score."""
+    if self.midi_file.lazy:
+      self.events.Rewind()
+      self.note_index = None
+    self.cursor.Reset()
+    self.score_keeper = scoring.ScoreKeeper()
+    self.DecodeAhead()
+
+  @property
+  def score(self):
+    return self.score_keeper.score
 
   def Advance(self, delta):
-    """Advances waterfall by delta ticks.
-    Returns False iff EOF reached.
-    """
-    while not self.EndOfSong():
-      event = self.midi_track.events[self.n_event]
-      if event.delta >= delta:
-        event.delta -= delta
-        self.time += delta
-        break
-      self.time += event.delta
-      delta -= event.delta
-      self.n_event += 1
-      if event.ignore_me:
-        continue
-      if event.cmd == 0x80:
-        self.state[event.note] = -1
-      elif event.cmd == 0x90:
-        self.state[event.note] = self.time
+    """Advances waterfall by delta ticks. Returns the notes that started or
+    stopped playing, as playback.PlaybackCursor.Advance."""
+    return self.cursor.Advance(delta)
 
   def WaterfallNoteColor(self, note):
     if note in self.active_notes:
-      if self.state[note] >= 0:
+      if self.cursor.state[note] >= 0:
         return '#00ff00'
     if note % 12 in (0,2,4,5,7,9,11):
       return '#8080ff'  # white note
@@ -94,69 +150,86 @@ class Waterfall(object):
       return '#80ffff'  # black note
 
   def Draw(self):
-    cur_time = self.time
-    cur_n_event = self.n_event
-    draw_state = copy.copy(self.state)
-    self.piano_output.Clear()
-    self.piano_output.DrawPiano(True)
+    profiler = self.profiler
+    self.piano_output.BeginFrame()
     for note in self.active_notes:
-      if self.state[note] < 0:
-        self.piano_output.SetKeyColor(note, color='#ff0000', wide=True)
-    while cur_n_event < len(self.midi_track.events):
-      event = self.midi_track.events[cur_n_event]
-      cur_time += event.delta
-      cur_n_event += 1
-      if cur_time > self.time + self.TICKS_SHOWN:
-        break
-      if event.ignore_me:
-        continue
-      if event.cmd == 0x80:
-        # Note turned off. Draw rect for it.
-        y1 = max(0, (draw_state[event.note] - self.time) * self.PIXELS_PER_TICK)
-        y2 = (cur_time - self.time) * self.PIXELS_PER_TICK
-        self.piano_output.DrawRect(
-            event.note, y1, y2, self.WaterfallNoteColor(event.note))
-        draw_state[event.note] = -1
-      elif event.cmd == 0x90:
-        # Note turned on. Store state.
-        if draw_state[event.note] >= 0:
-          # Note is already on, do nothing
-          print('Warning: Waterfall.Draw ignoring double note-on '
-                'for note %d' % event.note)
-        draw_state[event.note] = cur_time
-      else:
-        print 'Warning: Waterfall.Draw ignoring cmd %02X' % event.cmd
-    # Everything that's still playing should get a rect to end of screen.
-    for note, state in enumerate(draw_state):
-      if state >= 0:
-        y1 = max(0, (state - self.time) * self.PIXELS_PER_TICK)
-        y2 = self.TICKS_SHOWN * self.PIXELS_PER_TICK
-        self.piano_output.DrawRect(
-            note, y1, y2, self.WaterfallNoteColor(note))
+      if self.cursor.state[note] < 0:
+        self.piano_output.HighlightKey(note, color='#ff0000')
+    profiler.Mark(frame_profiler.PIANO)
+    if self.scrolling:
+      self.UpdateNoteLayer()
+    else:
+      cur_time = self.cursor.time
+      end_time = cur_time + self.TICKS_SHOWN
+      for interval in self.note_index.Query(cur_time, end_time):
+        y1 = max(0, (interval.start - cur_time) * self.PIXELS_PER_TICK)
+        y2 = (min(interval.end, end_time) - cur_time) * self.PIXELS_PER_TICK
+        self.piano_output.DrawNoteBar(
+            interval.note, y1, y2, self.WaterfallNoteColor(interval.note))
+    profiler.Mark(frame_profiler.NOTES)
 
     # Print score
     self.piano_output.SetTitle('Score: %d' % self.score)
+    if profiler.show_overlay:
+      self.piano_output.SetOverlay(profiler.OverlayText())
+    profiler.Mark(frame_profiler.TITLE)
+    self.piano_output.EndFrame(refresh=False)
+    profiler.Mark(frame_profiler.PIANO)
     self.piano_output.Refresh()
+    profiler.Mark(frame_profiler.REFRESH)
+
+  def UpdateNoteLayer(self):
+    """Scrolls the note layer to the current time, adds the bars of the notes
+    coming into view, and recolors the bars of notes whose color changed.
+    The layer is rebuilt when it went stale: the canvas was cleared, the
+    note index was rebuilt, or the song went back in time."""
+    cur_time = self.cursor.time
+    end_time = cur_time + self.TICKS_SHOWN
+    layer = self._note_layer
+    if (layer is None or layer is not self.piano_output.note_layer or
+        self._note_layer_index is not self.note_index or
+        cur_time < layer.time):
+      layer = self.piano_output.CreateNoteLayer(self.PIXELS_PER_TICK, cur_time)
+      self._note_layer = layer
+      self._note_layer_index = self.note_index
+      self._green_notes = set()
+      for interval in self.note_index.Query(cur_time, end_time):
+        layer.AddNote(interval.note, interval.start, interval.end,
+                      self.WaterfallNoteColor(interval.note))
+      self._next_interval = self.note_index.FirstStartingAt(end_time)
+    else:
+      layer.ScrollTo(cur_time)
+    green_notes = set(note for note in self.active_notes
+                      if self.cursor.state[note] >= 0)
+    for note in green_notes ^ self._green_notes:
+      layer.SetNoteColor(note, self.WaterfallNoteColor(note))
+    self._green_notes = green_notes
+    intervals = self.note_index.intervals
+    while (self._next_interval < len(intervals) and
+           intervals[self._next_interval].start < end_time):
+      interval = intervals[self._next_interval]
+      self._next_interval += 1
+      if interval.end > cur_time:
+        layer.AddNote(interval.note, interval.start, interval.end,
+                      self.WaterfallNoteColor(interval.note))
 
   def UpdatePianoInput(self):
+    """Applies the pending input of the piano. Every input is timestamped
+    with the wall clock time at which it was received."""
     while not self.piano_input.user_input.empty():
       user_cmd = self.piano_input.user_input.get()
+      self.piano_output.input_latency.Processed(user_cmd[2])
+      if self.input_recorder:
+        self.input_recorder.Record(user_cmd[2], user_cmd[0], user_cmd[1])
       if user_cmd[1] == 0 and user_cmd[0] in self.active_notes:
         self.active_notes.remove(user_cmd[0])
       if user_cmd[1] > 0:
           self.active_notes.add(user_cmd[0])
+      self.score_keeper.Press(user_cmd[2], user_cmd[0], user_cmd[1] > 0)
 
-  def UpdateScore(self, slowdown_factor=1.0):
-    gain = max(1, int(300.0 / slowdown_factor / slowdown_factor))
-    loss = max(1, int(50.0 / slowdown_factor / slowdown_factor))
-    for note in xrange(256):
-      if self.state[note] >= 0:
-        if note in self.active_notes:
-          self.score += gain
-        else:
-          self.score -= loss
-      if self.state[note] < 0 and note in self.active_notes:
-        self.score -= loss
+  def UpdateScore(self, time):
+    """Integrates the score up to wall clock |time|."""
+    self.score_keeper.AdvanceTo(time)
 
   def MenuRequested(self):
     return self.active_notes == set([
@@ -164,37 +237,84 @@ class Waterfall(object):
         self.piano_output.HIGHEST_NOTE])
 
   def Continue(self, slowdown_factor=1.0):
-    frames_per_sec = 15
-    prev_frame_wall_time = time.time()
+    """Plays from the current position until the end of the song, or until
+    the user requests the menu. Returns the score.
+
+    The song position follows the wall clock: before each frame, the cursor
+    is moved to the (fractional) tick reached after the wall time elapsed
+    since the start, slowed down by |slowdown_factor|. Frames which cannot be
+    drawn in time are dropped, so the song never falls behind. The notes the
+    song starts and stops playing are passed to the score keeper with the
+    wall time they are due at, not the time of the frame they fall into.
+
+    Each frame is timed by |profiler|, which reports the frames of the song
+    when it ends.
+    """
+    profiler = self.profiler
+    frame_period = 1.0 / self.frames_per_sec
+    tempo = self.midi_file.tempo
+    start_seconds = tempo.TicksToSeconds(self.cursor.time)
+    start_wall_time = self.clock.Now()
+    next_frame_time = start_wall_time
     self.active_notes = set()
+    self.score_keeper.SetSlowdown(slowdown_factor)
+    self.score_keeper.Resume(start_wall_time)
+    if self.input_recorder:
+      self.input_recorder.Start(start_wall_time, self.cursor.time,
+                                slowdown_factor)
 
     while not self.EndOfSong():
+      profiler.BeginFrame()
+      now = self.clock.Now()
       self.UpdatePianoInput()
+      profiler.Mark(frame_profiler.INPUT)
       if self.MenuRequested():
         break
 
-      self.UpdateScore(slowdown_factor)
+      self.UpdateScore(now)
+      profiler.Mark(frame_profiler.SCORE)
+      self.DecodeAhead()
+      profiler.Mark(frame_profiler.DECODE)
       self.Draw()
 
-      elapsed_wall_time = time.time() - prev_frame_wall_time
-      wait_time = 1.0 / frames_per_sec - elapsed_wall_time
-      if wait_time > 0: time.sleep(wait_time)
-      prev_frame_wall_time = time.time()
+      next_frame_time += frame_period
+      now = self.clock.Now()
+      overrun = 0.0
+      late_frames = 0
+      if now < next_frame_time:
+        self.clock.Sleep(next_frame_time - now)
+      else:
+        # Skip the frames whose time has already passed.
+        overrun = now - next_frame_time
+        late_frames = int(overrun / frame_period)
+        self.dropped_frames += late_frames
+        next_frame_time += late_frames * frame_period
+      profiler.Mark(frame_profiler.SLEEP)
 
-      delta = int(self.midi_file.GetTicksPerSec(self.time) / frames_per_sec /
-                  slowdown_factor)
-      if delta < 1:
-        delta = 1
-      self.Advance(delta)
-      prev_frame_wall_time = time.time()
+      song_time = tempo.SecondsToTicks(
+          start_seconds +
+          (self.clock.Now() - start_wall_time) / slowdown_factor)
+      if song_time > self.cursor.time:
+        for tick, note, playing in self.Advance(song_time - self.cursor.time):
+          self.score_keeper.Expect(
+              start_wall_time +
+              (tempo.TicksToSeconds(tick) - start_seconds) * slowdown_factor,
+              note, playing)
+      profiler.Mark(frame_profiler.ADVANCE)
+      profiler.EndFrame(self.piano_output.canvas, overrun, late_frames)
 
+    self.UpdateScore(self.clock.Now())
+    if self.input_recorder:
+      self.input_recorder.End(self.score_keeper.time, self.score)
+    if self.EndOfSong():
+      profiler.Report(self.name)
     return self.score
 
 
 def main():
   midi_file = midi.MidiFile(sys.argv[1])
   waterfall = Waterfall(piano_input_mock.PianoInput(),
-          piano_output.PianoOutput(), midi_file)
+          piano_output.PianoOutput(), midi_file, name=sys.argv[1])
   waterfall.Continue(slowdown_factor=1)
 
 